@@ -1,6 +1,7 @@
 import os,sys
 import platform
 import traceback
+import multiprocessing
 
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QIcon, QPixmap
@@ -448,7 +449,8 @@ class MainWindow(QMainWindow):
         if len(current_path) > 0 and os.path.isdir(current_base_dir):
             default_filename = current_path
         filepath, _ = QFileDialog.getSaveFileName(
-            self, "part save location", default_filename, "LDraw Part (*.dat)"
+            self, "part save location", default_filename,
+            "LDraw Part (*.dat);;Zip Archive (*.zip);;Compressed LDraw Model (*.mpd.gz)"
         )
         if filepath:
             self.output_file_line.setText(filepath)
@@ -588,7 +590,8 @@ class MainWindow(QMainWindow):
     def map_to_ldraw_colours(self):
         categories_dialog = ColourCategoriesDialog(
             message="Select Colour Categories Direct/HTML will be matched with.\n"
-                    "(Only Reversible by reloading and may take a while)"
+                    "(Only Reversible by reloading and may take a while)",
+            show_metric_selection=True
         )
 
         self.show_loading_screen("Mapping Colours\nCould take a bit of time")
@@ -599,7 +602,7 @@ class MainWindow(QMainWindow):
                 QMessageBox.warning(self, "Nothing Selected", "No Categories selected\nMapping Aborted")
                 return
             self.disable_settings(True)
-            self.ldraw_object.map_to_ldraw_colours(colour_categories)
+            self.ldraw_object.map_to_ldraw_colours(colour_categories, categories_dialog.get_selected_metric())
             self.subpart_panel.update_children()
             self.disable_settings(False)
             self.enable_reload()
@@ -640,4 +643,6 @@ def run():
 
 
 if __name__ == "__main__":
+    # Required for the worker processes of frozen (pyinstaller) builds
+    multiprocessing.freeze_support()
     run()
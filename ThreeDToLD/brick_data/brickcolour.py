@@ -1,4 +1,5 @@
 import os
+import weakref
 import numpy as np
 
 basedir = os.path.dirname(__file__)
@@ -45,52 +46,94 @@ def is_brickcolour(colour_code: str):
 
 
 class Brickcolour:
-    def __new__(cls, colour_code: str = "16", values=None):
-        if not is_brickcolour(colour_code)[0] and values is None:
-            return None
-        instance = super().__new__(cls)
-        return instance
+    __slots__ = ("colour_code", "colour_type", "ldrawname", "rgb_values", "rgb_edge", "alpha", "luminance",
+                 "material", "legoids", "legoname", "category", "int_rgba", "hex_rgba", "ldraw_line", "__weakref__")
+
+    def __new__(cls, colour_code: str = "16", values=None, alpha: str = None):
+        """
+        Brickcolours are immutable and shared,
+        LDraw colours are created once per colour code and direct colours once per rgba value.
+        :param values:
+            values of an LDraw colour in the order of the columns of colour_definitions.csv
+        :param alpha:
+            alpha value between 0 and 255 of a direct colour, 255 if None
+        """
+        if values is not None:
+            colour = _ldraw_colours.get(values[1])
+            if colour is None:
+                colour = super().__new__(cls)
+                colour._set_ldraw_values(values)
+                _ldraw_colours[values[1]] = colour
+            return colour
+        if colour_code.startswith("0x2") or colour_code.startswith("#"):
+            alpha = "255" if alpha is None else str(alpha)
+            colour = _direct_colours.get((colour_code, alpha))
+            if colour is None:
+                if not is_brickcolour(colour_code)[0]:
+                    return None
+                direct_code = colour_code
+                if colour_code.startswith("#"):
+                    direct_code = f"0x2{colour_code[1:].upper()}"
+                colour = _direct_colours.get((direct_code, alpha))
+                if colour is None:
+                    colour = super().__new__(cls)
+                    colour._set_direct_values(direct_code, alpha)
+                    _direct_colours[(direct_code, alpha)] = colour
+                _direct_colours[(colour_code, alpha)] = colour
+            return colour
+        colour = _ldraw_colours.get(colour_code)
+        if colour is None:
+            if not is_brickcolour(colour_code)[0]:
+                return None
+            # Loads the colour definitions, which creates all defined colours
+            values = get_colour_info_by_colour_code(colour_code)
+            colour = _ldraw_colours.get(colour_code)
+            if colour is None:
+                # Unknown colour code
+                colour = Brickcolour(values=values)
+        return colour
+
+    def _set_ldraw_values(self, values):
+        set_value = super().__setattr__
+        set_value("colour_type", "LDraw")
+        for name, value in zip(("ldrawname", "colour_code", "rgb_values", "rgb_edge", "alpha", "luminance",
+                                "material", "legoids", "legoname", "category"), values):
+            set_value(name, value)
+        self._set_derived_values()
+        line = f"0 !COLOUR {self.ldrawname} CODE {self.colour_code} VALUE {self.rgb_values} EDGE {self.rgb_edge}"
+        if int(self.alpha) < 255:
+            line += f" ALPHA {self.alpha}"
+        if self.luminance != "" and self.luminance is not None:
+            line += f" LUMINANCE {self.luminance}"
+        if self.material != "" and self.material is not None:
+            line += f" {self.material}"
+        line += "\n"
+        set_value("ldraw_line", line)
+
+    def _set_direct_values(self, colour_code: str, alpha: str):
+        set_value = super().__setattr__
+        set_value("colour_type", "Direct")
+        set_value("colour_code", colour_code)
+        set_value("rgb_values", f"#{colour_code[3:]}")
+        set_value("rgb_edge", get_contrast_colour(self.rgb_values))
+        set_value("alpha", alpha)
+        set_value("ldrawname", colour_code)
+        self._set_derived_values()
+
+    def _set_derived_values(self):
+        r = int(self.rgb_values[1:3], 16)
+        g = int(self.rgb_values[3:5], 16)
+        b = int(self.rgb_values[5:7], 16)
+        super().__setattr__("int_rgba", (r, g, b, int(self.alpha)))
+        super().__setattr__("hex_rgba", self.rgb_values + hex(int(self.alpha)).lstrip("0x"))
 
-    def __init__(self, colour_code: str = "16", values=None):
-        if values is None:
-            self.colour_code = colour_code
-            if colour_code.startswith("0x2"):
-                self.colour_type = "Direct"
-                self.rgb_values = f"#{self.colour_code[3:]}"
-                self.rgb_edge = get_contrast_colour(self.rgb_values)
-                self.alpha = "255"
-                self.ldrawname = self.colour_code
-            elif colour_code.startswith("#"):
-                colour_code = colour_code.upper()
-                self.colour_type = "Direct"
-                self.rgb_values = colour_code
-                self.colour_code = f"0x2{colour_code[1:]}"
-                self.rgb_edge = get_contrast_colour(self.rgb_values)
-                self.alpha = "255"
-                self.ldrawname = self.colour_code
-            else:
-                self.colour_type = "LDraw"
-                self.ldrawname, _, \
-                    self.rgb_values, \
-                    self.rgb_edge, \
-                    self.alpha, \
-                    self.luminance, \
-                    self.material, \
-                    self.legoids, \
-                    self.legoname, \
-                    self.category = get_colour_info_by_colour_code(self.colour_code)
-        else:
-            self.colour_type = "LDraw"
-            self.ldrawname, \
-                self.colour_code, \
-                self.rgb_values, \
-                self.rgb_edge, \
-                self.alpha, \
-                self.luminance, \
-                self.material, \
-                self.legoids, \
-                self.legoname, \
-                self.category = values
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Brickcolour is immutable, create a new Brickcolour instead of setting '{name}'")
+
+    def __reduce__(self):
+        if self.colour_type == "Direct":
+            return Brickcolour, (self.colour_code, None, self.alpha)
+        return Brickcolour, (self.colour_code,)
 
     def __getitem__(self, key):
         if key == 0:
@@ -127,8 +170,6 @@ class Brickcolour:
         return f"brickcolour({self.colour_code})"
 
     def get_hex_rgba(self) -> str:
-        if not hasattr(self, "hex_rgba"):
-            self.hex_rgba = self.rgb_values + hex(int(self.alpha)).lstrip("0x")
         return self.hex_rgba
 
     def __eq__(self, other):
@@ -136,74 +177,136 @@ class Brickcolour:
             return self.colour_code == other.colour_code
         return False
 
+    def __hash__(self):
+        return hash(self.colour_code)
+
     def get_int_rgba(self):
-        r = int(self.rgb_values[1:3], 16)
-        g = int(self.rgb_values[3:5], 16)
-        b = int(self.rgb_values[5:7], 16)
-        return r, g, b, int(self.alpha)
+        return self.int_rgba
 
     def get_ldraw_line(self) -> str:
-        line = f"0 !COLOUR {self.ldrawname} CODE {self.colour_code} VALUE {self.rgb_values} EDGE {self.rgb_edge}"
-        if int(self.alpha) < 255:
-            line += f" ALPHA {self.alpha}"
-        if self.luminance != "" and self.luminance is not None:
-            line += f" LUMINANCE {self.luminance}"
-        if self.material != "" and self.material is not None:
-            line += f" {self.material}"
-        line += "\n"
-        return line
+        return self.ldraw_line
+
+
+# Shared instances of the LDraw colours by colour code
+_ldraw_colours = {}
+# Shared instances of the direct colours by colour code and alpha,
+# only kept while they are used, models can contain many different colours
+_direct_colours = weakref.WeakValueDictionary()
+
+
+class ColourRegistry:
+    def __init__(self, filepath: str):
+        """
+        Colours of a colour definition file, the file is only read once
+        :param filepath:
+            csv file with the columns of Brickcolour(values) separated by ";"
+        """
+        # Values of the first definition of every colour code
+        self.colour_values = {}
+        self.brickcolours = []
+        # Positions of the colours in self.brickcolours by category
+        self.category_indices = {}
+        # Normalised LDraw name, Lego names and Lego IDs of the colours by colour code
+        self.search_texts = {}
+        # Colour codes by every substring of up to _name_index_length characters of the search texts
+        self.name_index = {}
+        with open(filepath, "r", encoding="utf-8") as source:
+            # skip row with column names
+            source.readline()
+            for line in source:
+                values = line.rstrip("\n").split(";")
+                self.colour_values.setdefault(values[1], values)
+                self.category_indices.setdefault(values[9], []).append(len(self.brickcolours))
+                self.brickcolours.append(Brickcolour(values=values))
+                self._add_to_name_index(values[1], (values[0], values[8], values[7]))
+
+    def _add_to_name_index(self, colour_code: str, names: tuple):
+        search_texts = tuple(normalise_colour_name(name) for name in names)
+        self.search_texts.setdefault(colour_code, search_texts)
+        for text in search_texts:
+            for length in range(1, _name_index_length + 1):
+                for start in range(len(text) - length + 1):
+                    self.name_index.setdefault(text[start:start + length], set()).add(colour_code)
+
+    def search_by_name(self, name: str) -> frozenset:
+        """
+        Returns the codes of the colours whose LDraw name, Lego names or Lego IDs contain the name,
+        spaces, underscores and case are ignored
+        """
+        name = normalise_colour_name(name)
+        if len(name) == 0:
+            return frozenset(self.search_texts)
+        if len(name) <= _name_index_length:
+            # A copy, the sets of the index must not be changed by the caller
+            return frozenset(self.name_index.get(name, ()))
+        # Colours containing every n-gram of the name are candidates, which are checked with the whole name
+        ngrams = sorted({name[start:start + _name_index_length]
+                         for start in range(len(name) - _name_index_length + 1)},
+                        key=lambda ngram: len(self.name_index.get(ngram, ())))
+        candidates = set(self.name_index.get(ngrams[0], ()))
+        for ngram in ngrams[1:]:
+            if len(candidates) == 0:
+                break
+            candidates.intersection_update(self.name_index.get(ngram, ()))
+        return frozenset(code for code in candidates if any(name in text for text in self.search_texts[code]))
 
+    def get_colour_info(self, colour_code: str) -> list:
+        values = self.colour_values.get(colour_code)
+        if values is None:
+            return ["Undefined", colour_code, "#FFFFFF", "000000", "255", "", "", "", "", ""]
+        # replace empty values with None
+        return [value if len(value) > 0 else None for value in values]
 
-def get_colour_info_by_colour_code(colour_code: str):
-    found_colour = ["Undefined", colour_code, "#FFFFFF", "000000", "255", "", "", "", "", ""]
-    with open(os.path.join(basedir, "colour_definitions.csv"), "r", encoding="utf-8") as source:
-        # skip row with column names
-        source.readline()
-        for line in source:
-            values = line.split(";")
-            if values[1] == colour_code:
-                for i in range(len(values)):
-                    # replace empty values with None
-                    if len(values[i]) == 0:
-                        values[i] = None
-                found_colour = values
-                # remove line break character from last value
-                found_colour[-1] = found_colour[-1][:-1]
-                break
+    def get_brickcolours(self, included_color_categories=None) -> list:
+        """Returns a new list with the colours of the categories in file order, all colours if None"""
+        if included_color_categories is None:
+            return list(self.brickcolours)
+        indices = []
+        for category, category_indices in self.category_indices.items():
+            if category in included_color_categories:
+                indices.extend(category_indices)
+        indices.sort()
+        return [self.brickcolours[index] for index in indices]
+
+
+# Maximum length of the substrings in the name index of the colour registry
+_name_index_length = 3
+_colour_registry = None
+
+
+def get_colour_registry() -> ColourRegistry:
+    """Returns the registry of colour_definitions.csv, it is created on first use"""
+    global _colour_registry
+    if _colour_registry is None:
+        _colour_registry = ColourRegistry(os.path.join(basedir, "colour_definitions.csv"))
+    return _colour_registry
 
-    return found_colour
+
+def get_colour_info_by_colour_code(colour_code: str):
+    return get_colour_registry().get_colour_info(colour_code)
 
 
 def get_all_brickcolours(included_color_categories=None):
-    colour_list = []
-    with open(os.path.join(basedir, "colour_definitions.csv"), "r", encoding="utf-8") as source:
-        # skip row with column names
-        source.readline()
-        for line in source:
-            values = line.split(";")
-            # remove line break character from last value
-            values[-1] = values[-1][:-1]
-            if included_color_categories is None or values[9] in included_color_categories:
-                colour_list.append(Brickcolour(values=values))
-    return colour_list
+    return get_colour_registry().get_brickcolours(included_color_categories)
 
 
 def search_brickcolour_by_rgb_colour(rgb_colour: str, colourlist: list):
-    colourlist.sort(key=lambda c: get_hex_colour_weight(rgb_colour, c.rgb_values))
-    return colourlist
+    """Returns a new list of the colours ordered by their RGB distance to the colour, the colourlist is not changed"""
+    # Imported here, colour_matching imports this module
+    from ThreeDToLD.brick_data.colour_matching import ColourMatcher
+    if len(colourlist) == 0:
+        return []
+    return ColourMatcher(colourlist).get_ranked_brickcolours(rgb_colour)
 
 
-def search_by_color_name(name: str, colourlist: list):
-    name = name.upper().replace(" ", "").replace("_", "")
+def normalise_colour_name(name: str) -> str:
+    return name.upper().replace(" ", "").replace("_", "")
 
-    def matchname(colour: Brickcolour):
-        if (name in colour.ldrawname.upper().replace(" ", "").replace("_", "") or
-                name in colour.legoname.upper().replace(" ", "").replace("_", "")):
-            return True
-        else:
-            return False
 
-    search_results = [colour for colour in colourlist if matchname(colour)]
+def search_by_color_name(name: str, colourlist: list):
+    """Returns the colours of the list whose LDraw name, Lego names or Lego IDs contain the name"""
+    matching_codes = get_colour_registry().search_by_name(name)
+    search_results = [colour for colour in colourlist if colour.colour_code in matching_codes]
     return search_results
 
 
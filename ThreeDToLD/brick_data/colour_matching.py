@@ -0,0 +1,427 @@
+import os
+import sys
+import hashlib
+import numpy as np
+from enum import Enum
+from scipy.spatial import cKDTree
+from ThreeDToLD.brick_data.brickcolour import Brickcolour, get_all_brickcolours
+
+# Maximum number of elements of the distance matrix of one chunk
+_chunk_elements = 1 << 22
+# Number of nearest colours of the kd-tree among which ties are resolved
+_kdtree_neighbours = 8
+# Changes the names of the cached lookup tables if the way they are built changes
+_lookup_table_version = 1
+# Number of lookup tables kept in the cache directory, the least recently used are deleted
+_cached_lookup_tables = 8
+# Smallest number of colours for which map_rgb_colours builds a lookup table
+_lookup_table_threshold = 100000
+
+
+class ColourMetric(Enum):
+    RGB = "RGB Distance"
+    CIE76 = "CIE76 (Lab Distance)"
+    CIEDE2000 = "CIEDE2000"
+
+
+class ColourMatcher:
+    def __init__(self, colourlist: list, use_kdtree=False, metric: ColourMetric = ColourMetric.RGB):
+        """
+        Finds the closest colours of a palette for arrays of rgb values,
+        with the RGB metric the result is the same as get_closest_brickcolour_by_rgb_colour.
+        If multiple colours have the same distance the first one in the list is returned
+        :param colourlist:
+            Brickcolours of the palette
+        :param use_kdtree:
+            use a kd-tree instead of comparing every colour with the whole palette,
+            faster for large palettes, not used for CIEDE2000
+        :param metric:
+            distance of the colours, CIE76 and CIEDE2000 compare the colours in the CIELAB colour space
+        """
+        if len(colourlist) == 0:
+            raise ValueError("No colours to match")
+        self.colourlist = colourlist
+        self.metric = metric
+        self.palette = hex_to_rgb_array([colour.rgb_values for colour in colourlist])
+        # Coordinates of the palette in the colour space of the metric
+        self.metric_palette = _to_metric_space(self.palette, metric)
+        self.tree = None
+        if use_kdtree and metric != ColourMetric.CIEDE2000:
+            # Colours with the same values are only added once, ties are resolved by the first index
+            self._tree_palette, self._tree_indices = np.unique(self.metric_palette, axis=0, return_index=True)
+            self.tree = cKDTree(self._tree_palette)
+
+    def match(self, rgb_colours) -> np.ndarray:
+        """
+        :param rgb_colours:
+            (n, 3) array of rgb values between 0 and 255 or list of hex colours like #FF0000
+        :return:
+            index of the closest colour in the palette for every colour
+        """
+        colours = _to_metric_space(_as_rgb_array(rgb_colours), self.metric)
+        if self.tree is not None:
+            return self._match_with_tree(colours)
+        indices = np.empty(len(colours), dtype=np.intp)
+        chunk_elements = _chunk_elements
+        if self.metric == ColourMetric.CIEDE2000:
+            # CIEDE2000 needs many temporary arrays of the size of the distance matrix
+            chunk_elements //= 16
+        chunk_size = max(1, chunk_elements // len(self.palette))
+        for start in range(0, len(colours), chunk_size):
+            distances = get_colour_distances(colours[start:start + chunk_size], self.metric_palette, self.metric)
+            # argmin returns the first minimum like min()
+            indices[start:start + chunk_size] = np.argmin(distances, axis=1)
+        return indices
+
+    def get_distances(self, rgb_colour: str) -> np.ndarray:
+        """Returns the distances of the colour to every colour of the palette"""
+        colour = _to_metric_space(_as_rgb_array([rgb_colour]), self.metric)
+        return get_colour_distances(colour, self.metric_palette, self.metric)[0]
+
+    def rank(self, rgb_colour: str, top_k: int = None) -> np.ndarray:
+        """
+        Returns the indices of the palette colours ordered by their distance to the colour,
+        colours with the same distance keep their order in the palette
+        :param rgb_colour:
+            hex colour like #FF0000
+        :param top_k:
+            only return the indices of the top_k closest colours
+        """
+        return rank_by_distance(self.get_distances(rgb_colour), top_k)
+
+    def get_ranked_brickcolours(self, rgb_colour: str, top_k: int = None) -> list[Brickcolour]:
+        """Returns a new list of the palette colours ordered by their distance to the colour"""
+        return [self.colourlist[index] for index in self.rank(rgb_colour, top_k).tolist()]
+
+    def _match_with_tree(self, colours: np.ndarray) -> np.ndarray:
+        neighbours = min(_kdtree_neighbours, len(self._tree_palette))
+        _, candidates = self.tree.query(colours, k=neighbours)
+        candidates = candidates.reshape(len(colours), neighbours)
+        # The distances are computed like without the tree to find all candidates with the same distance
+        candidate_colours = self._tree_palette[candidates]
+        distances = np.sum((candidate_colours - colours[:, None, :]) ** 2, axis=2)
+        candidate_indices = self._tree_indices[candidates]
+        is_closest = distances == distances.min(axis=1, keepdims=True)
+        candidate_indices = np.where(is_closest, candidate_indices, len(self.palette))
+        return candidate_indices.min(axis=1)
+
+    def get_closest_brickcolours(self, rgb_colours) -> list[Brickcolour]:
+        return [self.colourlist[index] for index in self.match(rgb_colours).tolist()]
+
+    def get_closest_brickcolour(self, rgb_colour: str) -> Brickcolour:
+        return self.colourlist[int(self.match([rgb_colour])[0])]
+
+
+class ColourLookupTable(ColourMatcher):
+    def __init__(self, colourlist: list, bins: int = 64, cache_directory: str = None):
+        """
+        Finds the closest colours of a palette by the RGB distance with a lookup table of bins³ cubes of the RGB space.
+        A cube whose 8 corners have the same closest colour only contains colours with this closest colour.
+        For the other cubes the table stores the few palette colours that can be the closest to a colour in the cube,
+        only these are compared with the colours in the cube.
+        The results are the same as with ColourMatcher.
+        :param colourlist:
+            Brickcolours of the palette
+        :param bins:
+            number of cubes along every axis, a power of two up to 256
+        :param cache_directory:
+            the table is saved to and loaded from this directory, named by a hash of the palette, not saved if None
+        """
+        if bins not in [1 << exponent for exponent in range(9)]:
+            raise ValueError(f"Number of bins has to be a power of two up to 256, not {bins}")
+        # The kd-tree is used to match the corners of the cubes
+        super().__init__(colourlist, use_kdtree=True)
+        self.bins = bins
+        self._shift = 8 - (bins.bit_length() - 1)
+        # Palette index of every cube, -(row + 1) for cubes with the candidates in that row of self.candidates
+        self.table = None
+        # Candidates in ascending order, filled with len(self.palette)
+        self.candidates = None
+        cache_file = None
+        if cache_directory is not None:
+            palette_hash = hashlib.blake2b(self.palette.tobytes(), digest_size=16)
+            palette_hash.update(f"{bins};{_lookup_table_version}".encode())
+            cache_file = os.path.join(cache_directory, f"colour_lut_{palette_hash.hexdigest()}.npz")
+            self._load(cache_file)
+        if self.table is None:
+            self._build()
+            if cache_file is not None:
+                self._save(cache_file)
+        # The filling index points to a colour that is further away than any colour of the palette
+        self._candidate_palette = np.vstack((self.palette, np.full((1, 3), 1 << 12, dtype=self.palette.dtype)))
+
+    def _build(self):
+        size = 256 // self.bins
+        # The corners of the last cube are at 256, outside the RGB values but still in the same cube
+        axis = np.arange(self.bins + 1) * size
+        corners = np.stack(np.meshgrid(axis, axis, axis, indexing="ij"), axis=-1).reshape(-1, 3)
+        corner_indices = super().match(corners).reshape((self.bins + 1,) * 3)
+        lowest = corner_indices[:-1, :-1, :-1].copy()
+        highest = lowest.copy()
+        for offset in np.ndindex(2, 2, 2):
+            corner = corner_indices[offset[0]:offset[0] + self.bins,
+                                    offset[1]:offset[1] + self.bins,
+                                    offset[2]:offset[2] + self.bins]
+            np.minimum(lowest, corner, out=lowest)
+            np.maximum(highest, corner, out=highest)
+        table = lowest.astype(np.int32)
+
+        ambiguous_cubes = np.argwhere(lowest != highest)
+        # Of colours with the same values only the first one can be the closest
+        _, unique_indices = np.unique(self.palette, axis=0, return_index=True)
+        unique_indices.sort()
+        palette = self.palette[unique_indices]
+        # The distances between the colours and the cubes are the sums of the distances along the axes,
+        # which only depend on the position of the cube on that axis
+        cube_start = np.arange(self.bins)[:, None] * size
+        cube_end = cube_start + size - 1
+        candidate_masks = np.empty((len(ambiguous_cubes), len(unique_indices)), dtype=bool)
+        chunk_size = max(1, _chunk_elements // len(unique_indices))
+        for start in range(0, len(ambiguous_cubes), chunk_size):
+            cubes = ambiguous_cubes[start:start + chunk_size]
+            smallest_distances = np.zeros((len(cubes), len(unique_indices)), dtype=np.int32)
+            largest_distances = np.zeros_like(smallest_distances)
+            for axis in range(3):
+                values = palette[:, axis]
+                nearest_offsets = np.clip(values, cube_start, cube_end) - values
+                furthest_offsets = np.maximum(np.abs(values - cube_start), np.abs(values - cube_end))
+                smallest_distances += (nearest_offsets ** 2)[cubes[:, axis]]
+                largest_distances += (furthest_offsets ** 2)[cubes[:, axis]]
+            # A colour can only be the closest to a colour in the cube if its smallest distance to the cube
+            # is not larger than the largest distance of another palette colour to the cube
+            candidate_masks[start:start + chunk_size] = (smallest_distances
+                                                         <= largest_distances.min(axis=1, keepdims=True))
+        candidate_count = int(candidate_masks.sum(axis=1).max(initial=0))
+        # Sorting the masks moves the candidates to the front in ascending order
+        order = np.argsort(~candidate_masks, axis=1, kind="stable")[:, :candidate_count]
+        dtype = np.int16 if len(self.palette) < np.iinfo(np.int16).max else np.int32
+        self.candidates = np.where(np.take_along_axis(candidate_masks, order, axis=1),
+                                   unique_indices[order], len(self.palette)).astype(dtype)
+        table[tuple(ambiguous_cubes.T)] = -1 - np.arange(len(ambiguous_cubes))
+        self.table = table
+
+    def _load(self, filepath: str):
+        try:
+            with np.load(filepath, allow_pickle=False) as data:
+                table = data["table"]
+                candidates = data["candidates"]
+        except (OSError, KeyError, ValueError):
+            return
+        if table.shape == (self.bins,) * 3 and candidates.ndim == 2:
+            self.table = table
+            self.candidates = candidates
+            # The modification time marks the recently used tables
+            try:
+                os.utime(filepath)
+            except OSError:
+                pass
+
+    def _save(self, filepath: str):
+        # The table is only a cache, it is built again if it can't be saved
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            temporary_path = f"{filepath}.{os.getpid()}.tmp"
+            with open(temporary_path, "wb") as file:
+                np.savez(file, table=self.table, candidates=self.candidates)
+            os.replace(temporary_path, filepath)
+            _prune_lookup_tables(os.path.dirname(filepath))
+        except OSError:
+            pass
+
+    def match(self, rgb_colours) -> np.ndarray:
+        """
+        :param rgb_colours:
+            (n, 3) array of rgb values between 0 and 255 or list of hex colours like #FF0000
+        :return:
+            index of the closest colour in the palette for every colour
+        """
+        colours = _as_rgb_array(rgb_colours)
+        cubes = colours >> self._shift
+        indices = self.table[cubes[:, 0], cubes[:, 1], cubes[:, 2]].astype(np.intp)
+        ambiguous = np.flatnonzero(indices < 0)
+        chunk_size = max(1, _chunk_elements // max(1, self.candidates.shape[1]))
+        for start in range(0, len(ambiguous), chunk_size):
+            positions = ambiguous[start:start + chunk_size]
+            candidates = self.candidates[-1 - indices[positions]]
+            differences = self._candidate_palette[candidates] - colours[positions, None, :]
+            distances = np.einsum("ijk,ijk->ij", differences, differences)
+            # The candidates are in ascending order, so the first minimum is the same as with ColourMatcher
+            indices[positions] = np.take_along_axis(candidates, np.argmin(distances, axis=1)[:, None], axis=1)[:, 0]
+        return indices
+
+    def get_ambiguous_share(self) -> float:
+        """Share of the cubes whose colours are compared with their candidates"""
+        return float(np.mean(self.table < 0))
+
+
+def _prune_lookup_tables(directory: str):
+    """Deletes all but the _cached_lookup_tables most recently used lookup tables of the directory"""
+    tables = []
+    for entry in os.scandir(directory):
+        if entry.name.startswith("colour_lut_") and entry.name.endswith(".npz"):
+            try:
+                tables.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+    tables.sort(reverse=True)
+    for _, path in tables[_cached_lookup_tables:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_cache_directory() -> str:
+    """Directory of the cached colour lookup tables"""
+    if sys.platform == "win32":
+        base_directory = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base_directory = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+    else:
+        base_directory = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base_directory, "3DToLD")
+
+
+_colour_matchers = {}
+
+
+def get_colour_matcher(included_colour_categories=None, use_kdtree=False,
+                       metric: ColourMetric = ColourMetric.RGB, use_lookup_table=False) -> ColourMatcher:
+    """
+    Returns the matcher of the colours of the categories, all colours if None.
+    Matchers are created once for every selection of categories and metric.
+    :param use_lookup_table:
+        return a ColourLookupTable cached in the cache directory, only used with the RGB metric
+    """
+    categories = None
+    if included_colour_categories is not None:
+        categories = frozenset(included_colour_categories)
+    use_lookup_table = use_lookup_table and metric == ColourMetric.RGB
+    key = (categories, use_kdtree, metric, use_lookup_table)
+    if key not in _colour_matchers:
+        colourlist = get_all_brickcolours(included_colour_categories)
+        if use_lookup_table:
+            _colour_matchers[key] = ColourLookupTable(colourlist, cache_directory=get_cache_directory())
+        else:
+            _colour_matchers[key] = ColourMatcher(colourlist, use_kdtree, metric)
+    return _colour_matchers[key]
+
+
+def map_rgb_colours(rgb_colours, included_colour_categories=None) -> list[Brickcolour]:
+    """
+    Returns the closest Brickcolour of the categories, all colours if None, for every colour by the RGB distance.
+    A ColourLookupTable is only used for at least _lookup_table_threshold colours, it takes about a second to build.
+    :param rgb_colours:
+        (n, 3) array of rgb values between 0 and 255 or list of hex colours like #FF0000
+    """
+    use_lookup_table = len(rgb_colours) >= _lookup_table_threshold
+    colour_matcher = get_colour_matcher(included_colour_categories, use_lookup_table=use_lookup_table)
+    return colour_matcher.get_closest_brickcolours(rgb_colours)
+
+
+def rank_by_distance(distances: np.ndarray, top_k: int = None) -> np.ndarray:
+    """
+    Returns the indices of the distances in ascending order, equal distances keep their order
+    :param distances:
+        one dimensional array of distances
+    :param top_k:
+        only return the indices of the top_k smallest distances
+    """
+    if top_k is None or top_k >= len(distances):
+        return np.argsort(distances, kind="stable")
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+    # Distances equal to the largest selected one are all kept, so the first of them can be chosen by index
+    threshold = np.partition(distances, top_k - 1)[top_k - 1]
+    candidates = np.flatnonzero(distances <= threshold)
+    order = np.argsort(distances[candidates], kind="stable")[:top_k]
+    return candidates[order]
+
+
+def get_colour_distances(colours: np.ndarray, palette: np.ndarray, metric: ColourMetric) -> np.ndarray:
+    """
+    Returns the (n, m) distances between the colours and the palette,
+    squared distances for RGB and CIE76, both arrays have to be in the colour space of the metric
+    """
+    if metric == ColourMetric.CIEDE2000:
+        return ciede2000(colours[:, None, :], palette[None, :, :])
+    differences = colours[:, None, :] - palette[None, :, :]
+    return np.einsum("ijk,ijk->ij", differences, differences)
+
+
+def rgb_to_lab(rgb_colours: np.ndarray) -> np.ndarray:
+    """Converts (n, 3) sRGB values between 0 and 255 to CIELAB with the D65 white point"""
+    rgb = np.asarray(rgb_colours, dtype=np.float64) / 255
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _srgb_to_xyz.T / _d65_white
+    delta = 6 / 29
+    f = np.where(xyz > delta ** 3, np.cbrt(xyz), xyz / (3 * delta ** 2) + 4 / 29)
+    lightness = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack((lightness, a, b), axis=-1)
+
+
+def ciede2000(lab_1: np.ndarray, lab_2: np.ndarray) -> np.ndarray:
+    """CIEDE2000 colour difference of broadcastable arrays of Lab colours with shape (..., 3)"""
+    l_1, a_1, b_1 = lab_1[..., 0], lab_1[..., 1], lab_1[..., 2]
+    l_2, a_2, b_2 = lab_2[..., 0], lab_2[..., 1], lab_2[..., 2]
+    c_mean_7 = ((np.hypot(a_1, b_1) + np.hypot(a_2, b_2)) / 2) ** 7
+    g = 0.5 * (1 - np.sqrt(c_mean_7 / (c_mean_7 + 25 ** 7)))
+    a_1 = (1 + g) * a_1
+    a_2 = (1 + g) * a_2
+    c_1 = np.hypot(a_1, b_1)
+    c_2 = np.hypot(a_2, b_2)
+    h_1 = np.degrees(np.arctan2(b_1, a_1)) % 360
+    h_2 = np.degrees(np.arctan2(b_2, a_2)) % 360
+    has_no_hue = c_1 * c_2 == 0
+
+    delta_l = l_2 - l_1
+    delta_c = c_2 - c_1
+    delta_h = h_2 - h_1
+    delta_h = np.where(delta_h > 180, delta_h - 360, np.where(delta_h < -180, delta_h + 360, delta_h))
+    delta_h = np.where(has_no_hue, 0, delta_h)
+    delta_h = 2 * np.sqrt(c_1 * c_2) * np.sin(np.radians(delta_h / 2))
+
+    l_mean = (l_1 + l_2) / 2
+    c_mean = (c_1 + c_2) / 2
+    h_sum = h_1 + h_2
+    h_mean = np.where(np.abs(h_1 - h_2) <= 180, h_sum / 2, np.where(h_sum < 360, h_sum / 2 + 180, h_sum / 2 - 180))
+    h_mean = np.where(has_no_hue, h_sum, h_mean)
+
+    t = (1 - 0.17 * np.cos(np.radians(h_mean - 30)) + 0.24 * np.cos(np.radians(2 * h_mean))
+         + 0.32 * np.cos(np.radians(3 * h_mean + 6)) - 0.20 * np.cos(np.radians(4 * h_mean - 63)))
+    delta_theta = 30 * np.exp(-((h_mean - 275) / 25) ** 2)
+    c_mean_7 = c_mean ** 7
+    r_c = 2 * np.sqrt(c_mean_7 / (c_mean_7 + 25 ** 7))
+    s_l = 1 + 0.015 * (l_mean - 50) ** 2 / np.sqrt(20 + (l_mean - 50) ** 2)
+    s_c = 1 + 0.045 * c_mean
+    s_h = 1 + 0.015 * c_mean * t
+    r_t = -np.sin(np.radians(2 * delta_theta)) * r_c
+    return np.sqrt((delta_l / s_l) ** 2 + (delta_c / s_c) ** 2 + (delta_h / s_h) ** 2
+                   + r_t * (delta_c / s_c) * (delta_h / s_h))
+
+
+def hex_to_rgb_array(hex_colours: list) -> np.ndarray:
+    """Converts hex colours like #FF0000 to an (n, 3) array of rgb values"""
+    values = np.array([int(colour[1:7], 16) for colour in hex_colours], dtype=np.int64)
+    shifts = np.array([16, 8, 0], dtype=np.int64)
+    return ((values[:, None] >> shifts) & 0xFF).astype(np.int32)
+
+
+def _as_rgb_array(rgb_colours) -> np.ndarray:
+    if len(rgb_colours) > 0 and isinstance(rgb_colours[0], str):
+        return hex_to_rgb_array(rgb_colours)
+    return np.asarray(rgb_colours, dtype=np.int32).reshape(-1, 3)
+
+
+def _to_metric_space(rgb_colours: np.ndarray, metric: ColourMetric) -> np.ndarray:
+    if metric == ColourMetric.RGB:
+        return rgb_colours
+    return rgb_to_lab(rgb_colours)
+
+
+_srgb_to_xyz = np.array([[0.4124564, 0.3575761, 0.1804375],
+                         [0.2126729, 0.7151522, 0.0721750],
+                         [0.0193339, 0.1191920, 0.9503041]])
+_d65_white = np.array([0.95047, 1.0, 1.08883])
@@ -3,9 +3,15 @@ import trimesh
 import trimesh.visual.material
 from trimesh.base import Trimesh
 import os
+import io
+import hashlib
+import gzip
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, Future
+from multiprocessing.shared_memory import SharedMemory
 from ThreeDToLD.appexcetions import *
-from ThreeDToLD.brick_data.brickcolour import Brickcolour, get_closest_brickcolour_by_rgb_colour, \
-    get_all_brickcolours
+from ThreeDToLD.brick_data.brickcolour import Brickcolour
+from ThreeDToLD.brick_data.colour_matching import ColourMatcher, ColourMetric, get_colour_matcher
 import numpy as np
 from collections import OrderedDict
 from ThreeDToLD.model_loaders.trimeshloader import Trimeshloader
@@ -81,19 +87,31 @@ class LdrawObject:
 
     def load_scene(self, filepath: str, scale=1, multi_object=True, multicolour=True,
                    use_ldraw_rotation=True, override_metadata=True,
-                   use_threemfloader=True, unit_conversion=LDrawConversionFactor.Auto
+                   use_threemfloader=True, unit_conversion=LDrawConversionFactor.Auto,
+                   streaming=False, workers=1, file_type: str = None
                    ):
+        """
+        :param filepath:
+            path of the 3D file, can also be a file object, a memory-mapped file or the file content as bytes
+        :param file_type:
+            file extension like "3mf", required if filepath is not a path
+        """
 
         # Todo: Pass unit conversion option as a parameter
-        _, file_extension = os.path.splitext(filepath)
+        if file_type is not None:
+            file_extension = f".{file_type.lstrip('.')}"
+        elif isinstance(filepath, (str, os.PathLike)):
+            _, file_extension = os.path.splitext(filepath)
+        else:
+            raise ValueError("No file_type given for file without filepath")
 
         if use_threemfloader and file_extension == ".3mf":
-            loader = Threemfloader()
+            loader = Threemfloader(streaming=streaming, workers=workers)
         else:
             loader = Trimeshloader()
 
         try:
-            scene, metadata = loader.load_model(filepath)
+            scene, metadata = loader.load_model(filepath, file_type)
         except NotImplementedError as exc:
             raise FileTypeUnsupportedError("The filetype is not supported by Trimesh") from exc
         except (Missing3mfElementError, RecursionError) as exc:
@@ -120,26 +138,23 @@ class LdrawObject:
         for geometry in scene.geometry.values():
             if hasattr(geometry, "visual") and isinstance(geometry.visual, trimesh.visual.texture.TextureVisuals):
                 if isinstance(geometry.visual.material, trimesh.visual.material.MultiMaterial):
-                    material_colours = []
-                    for material in geometry.visual.material.materials:
-                        material_colours.append(material.main_color)
-                    face_colours = []
-                    for material_idx in geometry.visual.face_materials:
-                        face_colours.append(material_colours[material_idx])
+                    material_colours = np.array(
+                        [material.main_color for material in geometry.visual.material.materials], dtype=np.uint8)
+                    face_colours = material_colours[geometry.visual.face_materials]
                     geometry.visual = trimesh.visual.color.ColorVisuals(geometry, face_colors=face_colours)
                 else:
                     material_colour = geometry.visual.material.main_color
-                    geometry.visual = geometry.visual.to_color()
+                    face_colours = _sample_texture_at_faces(geometry)
+                    if face_colours is not None:
+                        geometry.visual = trimesh.visual.color.ColorVisuals(geometry, face_colors=face_colours)
+                    else:
+                        geometry.visual = geometry.visual.to_color()
                     try:
                         geometry.visual.face_colors
                     except IndexError:
                         # Invalid Color Data -> can occur when loading some step files
                         geometry.visual.face_colors = np.ones((len(geometry.faces), 4), np.uint8) * [102, 102, 102, 255]
-                    for colour in geometry.visual.face_colors:
-                        c_check = [102, 102, 102, 255] == colour
-                        if not (c_check[0] and c_check[1] and c_check[2] and c_check[3]):
-                            break
-                    else:
+                    if get_colour_summary(geometry).only_contains([102, 102, 102, 255]):
                         # Face Colors only include the Default colour
                         geometry.visual.face_colors = np.ones((len(geometry.faces), 4), np.uint8) * material_colour
             try:
@@ -148,46 +163,38 @@ class LdrawObject:
                 # Invalid Color Data -> can occur when loading some step files
                 geometry.visual.face_colors = np.ones((len(geometry.faces), 4), np.uint8) * [102, 102, 102, 255]
 
-        if len(scene.geometry) == 1:
+        # Geometries can be shared by multiple nodes(instances), so nodes are counted instead of geometries
+        if len(scene.graph.nodes_geometry) == 1:
             geometry = list(scene.geometry.values())[0]
-            first_colour = geometry.visual.face_colors[0]
-            for colour in geometry.visual.face_colors:
-                c_check = first_colour == colour
-                if not (c_check[0] and c_check[1] and c_check[2] and c_check[3]):
-                    break
-            else:
+            if get_colour_summary(geometry).single_colour:
                 # Only One Object with one colour
                 geometry.visual.face_colors = np.ones((len(geometry.faces), 4), np.uint8) * [102, 102, 102, 255]
 
-        if len(scene.geometry) > 1 and not multi_object:
-            if len(scene.geometry) > 1 and multicolour:
+        if len(scene.graph.nodes_geometry) > 1 and not multi_object:
+            if len(scene.graph.nodes_geometry) > 1 and multicolour:
                 recolour = True
-                if len(scene.geometry) == 1:
-                    recolour = False
                 for geometry in scene.geometry.values():
                     if not recolour:
                         break
 
-                    c_check = geometry.visual.main_color == [102, 102, 102, 255]
-                    default_colour = c_check[0] and c_check[1] and c_check[2] and c_check[3]
-                    if not default_colour:
+                    colour_summary = get_colour_summary(geometry)
+                    if not np.all(colour_summary.main_colour == [102, 102, 102, 255]):
                         recolour = False
                         break
 
-                    has_multiple_colours = False
-                    first_colour = geometry.visual.face_colors[0]
-                    for colour in geometry.visual.face_colors:
-                        c_check = first_colour == colour
-                        if not (c_check[0] and c_check[1] and c_check[2] and c_check[3]):
-                            has_multiple_colours = True
-                            break
-
-                    if has_multiple_colours:
+                    if not colour_summary.single_colour:
                         recolour = False
                         break
                 if recolour:
+                    # Instances sharing a geometry get their own copy to receive different colours
+                    for node in scene.graph.nodes_geometry:
+                        transform, key = scene.graph[node]
+                        if scene.graph.geometry_nodes[key][0] != node:
+                            scene.add_geometry(scene.geometry[key].copy(), node_name=node, geom_name=key,
+                                               transform=transform)
                     colorrange = [0, 63, 127, 191, 255]
-                    for index, geometry in enumerate(scene.geometry.values()):
+                    for index, node in enumerate(scene.graph.nodes_geometry):
+                        geometry = scene.geometry[scene.graph[node][1]]
                         # only 125 different colors possible
                         g = colorrange[index % 5]
                         r = colorrange[int(index / 5 % 5)]
@@ -207,7 +214,7 @@ class LdrawObject:
                 [0, 1, 0, 0],
                 [0, 0, 0, 1]
             ])
-            if len(scene.geometry) == 1 and (
+            if len(scene.graph.nodes_geometry) == 1 and (
                     unit_conversion == LDrawConversionFactor.Auto or unit_conversion == LDrawConversionFactor.LDraw
             ) and scale == 1:
                 # "baking" rotation in case only one geometry exist
@@ -252,31 +259,71 @@ class LdrawObject:
                     geometry.visual.face_colors = np.ones((len(geometry.faces), 4), np.uint8) * 255
                     main_colour = Brickcolour("16")
                 else:
-                    c_check = geometry.visual.main_color == [102, 102, 102, 255]
-                    default_colour = c_check[0] and c_check[1] and c_check[2] and c_check[3]
-                    if default_colour:
+                    main_rgba = get_colour_summary(geometry).main_colour
+                    if np.all(main_rgba == [102, 102, 102, 255]):
                         main_colour = Brickcolour("16")
                     else:
-                        hexcolour = rgba_to_hex(geometry.visual.main_color)[:7]
+                        hexcolour = rgba_to_hex(main_rgba)[:7]
                         main_colour = Brickcolour(hexcolour)
                 if "matrix" in scene_graph.edge_data[("world", node)]:
                     transformation_matrix = scene_graph.edge_data[("world", node)]["matrix"]
                 else:
                     transformation_matrix = trimesh.transformations.identity_matrix()
+                name = key
+                if len(scene.graph.geometry_nodes[key]) > 1:
+                    # Geometry is shared by multiple instances
+                    name = node
                 self.subparts.append(
-                    Subpart(geometry, transformation_matrix, key, main_colour, self.cached_colour_definitions, key)
+                    Subpart(geometry, transformation_matrix, name, main_colour, self.cached_colour_definitions, key)
                 )
         self.scene = scene
         self.model_loaded = True
 
-    def convert_to_dat_file(self, filepath=None, one_file=False):
+    def convert_to_dat_file(self, filepath=None, one_file=False, precision: int = None, workers: int = 1,
+                            share_duplicates=True):
+        """
+        :param filepath:
+            path of the main file, a file-like object (always written as one file)
+            or None to return the result as string.
+            Paths ending with .zip are written as archive with the main file and the s/ files as entries,
+            paths ending with .gz (e.g. model.mpd.gz) are written as one gzip compressed file
+        :param precision:
+            number of decimals of coordinates and matrices, trailing zeros are removed.
+            None writes coordinates with full float precision
+        :param workers:
+            number of processes rendering the subparts, the output does not depend on it
+        :param share_duplicates:
+            subparts with identical geometry and colours are only written once
+            and referenced by all instances
+        """
         if not self.model_loaded:
             raise Exception("No model loaded")
+        # Archive and compressed outputs are written to target instead of filepath
+        write_archive = False
+        write_gzip = False
+        archive = None
+        target = filepath
         if filepath is None:
             one_file = True
             filename = self.name.replace(" ", "_")
-        else:
+        elif isinstance(filepath, (str, os.PathLike)):
             filename = os.path.basename(filepath)
+            if filename.lower().endswith(".zip"):
+                filename = f"{filename[:-4]}.dat"
+                write_archive = True
+            elif filename.lower().endswith(".gz"):
+                # Subparts can only be written into the same file
+                one_file = True
+                filename = filename[:-3]
+                write_gzip = True
+        else:
+            # File-like object, subparts can only be written into the same file
+            one_file = True
+            filename = getattr(filepath, "name", None)
+            if isinstance(filename, str):
+                filename = os.path.basename(filename)
+            else:
+                filename = self.name.replace(" ", "_")
         bricklinknumberline = ""
         if len(self.bricklinknumber) > 0:
             bricklinknumberline = f"0 BL_Item_No {self.bricklinknumber}\n\n"
@@ -316,59 +363,143 @@ class LdrawObject:
                   f"{categoryline}"
                   f"{keyword_lines}\n")
 
-        with ResultWriter(filepath) as file:
-            file.write(header)
-            if len(self.subparts) == 1:
-                subpart = self.subparts[0]
-                color_code = "16"
-                if not subpart.multicolour:
-                    color_code = subpart.main_colour.colour_code
-                for line in subpart.to_ldraw_lines(color_code, apply_transform=True):
-                    file.write(line)
-            else:
-                if one_file:
-                    subparts_lines = []
+        try:
+            # Opened inside try, so they are closed if writing fails
+            if write_archive:
+                archive = zipfile.ZipFile(filepath, "w", zipfile.ZIP_DEFLATED)
+                if one_file or len(self.subparts) == 1:
+                    target = archive.open(filename, "w", force_zip64=True)
+                else:
+                    # Only one archive entry can be written at a time, the main file is written after the subparts
+                    target = None
+            elif write_gzip:
+                target = gzip.open(filepath, "wb")
+            with ResultWriter(target) as file:
+                file.write(header)
+                if len(self.subparts) == 1:
+                    subpart = self.subparts[0]
+                    color_code = "16"
+                    if not subpart.multicolour:
+                        color_code = subpart.main_colour.colour_code
+                    for line in subpart.to_ldraw_lines(color_code, apply_transform=True, precision=precision):
+                        file.write(line)
+                else:
+                    self._write_subparts(file, archive, filename, license_line, one_file, precision, workers,
+                                         None if one_file or archive is not None else os.path.dirname(filepath),
+                                         share_duplicates)
+                if filepath is None:
+                    return file.get_result()
+                if archive is not None and target is None:
+                    archive.writestr(filename, file.get_result())
+        finally:
+            if target is not filepath and target is not None:
+                target.close()
+            if archive is not None:
+                archive.close()
+
+    def _write_subparts(self, file, archive, filename: str, license_line: str, one_file: bool, precision: int,
+                        workers: int, directory: str = None, share_duplicates=True):
+        """
+        Writes the references of the subparts into the main file and the subparts into their target
+        :param file:
+            ResultWriter of the main file
+        :param archive:
+            ZipFile the subparts are written into as s/ entries, if not writing one file
+        :param directory:
+            directory of the main file, the subparts are written into its s/ directory
+        :param share_duplicates:
+            write identical subparts only once
+        """
+        if one_file:
+            subparts_lines = []
+        elif directory is not None:
+            sub_dir = f"{directory}/s/"
+            os.makedirs(sub_dir, exist_ok=True)
+        # Without the extension of the main file, like .dat or .mpd of model.mpd.gz
+        basename = os.path.splitext(filename)[0]
+        pool = None
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+        # Subparts rendered by the workers in subpart order
+        renderings = []
+        entry_names = []
+        shared_memories = []
+        # Names of the written subparts by geometry hash
+        shared_subfilenames = {}
+        count = 0
+        try:
+            for part in self.subparts:
+                geometry_hash = None
+                if share_duplicates:
+                    geometry_hash = part.get_geometry_hash()
+                is_duplicate = geometry_hash in shared_subfilenames
+                if is_duplicate:
+                    subfilename = shared_subfilenames[geometry_hash]
                 else:
-                    sub_dir = f"{os.path.dirname(filepath)}/s/"
-                    os.makedirs(sub_dir, exist_ok=True)
-                basename = filename.split(".dat")[0]
-                for count, part in enumerate(self.subparts):
                     subfilename = f"{basename}s{count:03d}.dat"
-                    if not one_file:
-                        # Todo: Case filepath = None
+                    count += 1
+                    if geometry_hash is not None:
+                        shared_subfilenames[geometry_hash] = subfilename
+                if not one_file and not is_duplicate:
+                    header = part.get_ldraw_header(fr"s\{subfilename}", filename, self.author, license_line)
+                    subfilepath = None
+                    if archive is None:
                         subfilepath = f"{sub_dir}{subfilename}"
-                        part.convert_to_dat_file(subfilepath, filename, self.author, license_line)
-                    tm_a = f"{part.transformation_matrix[0][0]:f}"
-                    tm_b = f"{part.transformation_matrix[0][1]:f}"
-                    tm_c = f"{part.transformation_matrix[0][2]:f}"
-                    tm_d = f"{part.transformation_matrix[1][0]:f}"
-                    tm_e = f"{part.transformation_matrix[1][1]:f}"
-                    tm_f = f"{part.transformation_matrix[1][2]:f}"
-                    tm_g = f"{part.transformation_matrix[2][0]:f}"
-                    tm_h = f"{part.transformation_matrix[2][1]:f}"
-                    tm_i = f"{part.transformation_matrix[2][2]:f}"
-                    tm_x = f"{part.transformation_matrix[0][3]:f}"
-                    tm_y = f"{part.transformation_matrix[1][3]:f}"
-                    tm_z = f"{part.transformation_matrix[2][3]:f}"
-                    # Todo: Improve precision of floats to string conversion (np.float64(1))
-                    code = part.main_colour.colour_code
-                    if not one_file:
-                        subfilename = fr"s\{subfilename}"
-                    file.write(f"0 //~{part.name}\n"
-                               f"1 {code} {tm_x} {tm_y} {tm_z}"
-                               f" {tm_a} {tm_b} {tm_c}"
-                               f" {tm_d} {tm_e} {tm_f}"
-                               f" {tm_g} {tm_h} {tm_i}"
-                               f" {subfilename}\n")
-                    if one_file:
-                        subparts_lines.append(
-                            f"\n{part.get_ldraw_header(subfilename, filename, self.author, license_line)}")
-                        for line in part.to_ldraw_lines():
+                    if pool is not None:
+                        # Workers return the text of archive entries, files are written by the workers
+                        rendering, memory = part.submit_rendering(pool, header, precision, subfilepath)
+                        renderings.append(rendering)
+                        entry_names.append(f"s/{subfilename}")
+                        shared_memories.append(memory)
+                    elif archive is None:
+                        part.convert_to_dat_file(subfilepath, filename, self.author, license_line, precision)
+                    else:
+                        with (archive.open(f"s/{subfilename}", "w", force_zip64=True) as entry,
+                              ResultWriter(entry) as subfile):
+                            subfile.write(header)
+                            for line in part.to_ldraw_lines(precision=precision):
+                                subfile.write(line)
+                matrix = np.asarray(part.transformation_matrix, dtype=np.float64)
+                # Position followed by the rotation/scale matrix
+                matrix_values = np.concatenate((matrix[:3, 3], matrix[:3, :3].ravel()))
+                if precision is None:
+                    matrix_strings = [f"{value:f}" for value in matrix_values]
+                else:
+                    matrix_strings = _format_numbers(matrix_values, precision)
+                code = part.main_colour.colour_code
+                if not one_file:
+                    subfilename = fr"s\{subfilename}"
+                file.write(f"0 //~{part.name}\n"
+                           f"1 {code} {' '.join(matrix_strings)}"
+                           f" {subfilename}\n")
+                if one_file and not is_duplicate:
+                    header = f"\n{part.get_ldraw_header(subfilename, filename, self.author, license_line)}"
+                    if pool is None:
+                        subparts_lines.append(header)
+                        for line in part.to_ldraw_lines(precision=precision):
                             subparts_lines.append(line)
-                if one_file:
+                    else:
+                        rendering, memory = part.submit_rendering(pool, header, precision)
+                        renderings.append(rendering)
+                        shared_memories.append(memory)
+            if one_file:
+                if pool is None:
                     file.write_list(subparts_lines)
-            if filepath is None:
-                return file.get_result()
+                else:
+                    for rendering in renderings:
+                        file.write(rendering.result())
+            else:
+                for rendering, entry_name in zip(renderings, entry_names):
+                    # Raises errors of the workers
+                    result = rendering.result()
+                    if archive is not None:
+                        archive.writestr(entry_name, result)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            for memory in shared_memories:
+                memory.close()
+                memory.unlink()
 
     def set_main_colour(self, colour: Brickcolour):
         if not self.model_loaded:
@@ -389,14 +520,20 @@ class LdrawObject:
         for subpart in self.subparts:
             subpart.generate_outlines(angle_threshold, merge_vertices)
 
-    def map_to_ldraw_colours(self, included_colour_categories):
+    def map_to_ldraw_colours(self, included_colour_categories, metric: ColourMetric = ColourMetric.RGB):
         if not self.model_loaded:
             raise Exception("No model loaded")
+        # The palette is only prepared once for all subparts
+        colour_matcher = get_colour_matcher(included_colour_categories, metric=metric)
         for subpart in self.subparts:
-            subpart.map_to_ldraw_colours(included_colour_categories)
+            subpart.map_to_ldraw_colours(included_colour_categories, colour_matcher)
 
     def delete_subpart(self, subpart):
         self.subparts.remove(subpart)
+        for part in self.subparts:
+            if part.node_key == subpart.node_key:
+                # Geometry is still used by another instance
+                return
         self.scene.delete_geometry(subpart.node_key)
 
 
@@ -416,6 +553,9 @@ class Subpart:
         self.vertices_with_transform = None
         self.cached_colour_definitions = cached_colour_definitions
         self.node_key = node_key
+        # Rendered LDraw lines by (apply_transform, precision) and colour group, only for the last used key
+        self._rendered_lines = {}
+        self._multicolour = False
         if outlines is None:
             self.outlines = []
         else:
@@ -427,6 +567,25 @@ class Subpart:
         else:
             self._colour_from_dict(colours, main_colour)
 
+    @property
+    def outlines(self):
+        return self._outlines
+
+    @outlines.setter
+    def outlines(self, outlines):
+        self._outlines = outlines
+        self._invalidate_rendering("outlines")
+
+    @property
+    def multicolour(self) -> bool:
+        return self._multicolour
+
+    @multicolour.setter
+    def multicolour(self, multicolour: bool):
+        if multicolour != self._multicolour:
+            self._invalidate_rendering()
+        self._multicolour = multicolour
+
     def _colour_from_mesh(self, main_colour: Brickcolour):
         if not self.mesh.visual.defined:
             if main_colour is not None:
@@ -439,20 +598,14 @@ class Subpart:
             self.apply_color()
         else:
             self.colours = OrderedDict()
-            is_invisible = True
-            has_transparency = False
-            for index, colour in enumerate(self.mesh.visual.face_colors):
+            colour_summary = get_colour_summary(self.mesh)
+            # Colours in order of their first face
+            for colour_index in np.argsort(colour_summary.first_indices):
+                colour = colour_summary.colours[colour_index]
                 hex_colour = rgba_to_hex(colour)
-                if hex_colour in self.colours:
-                    self.colours[hex_colour][1].append(index)
-                else:
-                    brickcolour = Brickcolour(hex_colour[:7])
-                    brickcolour.alpha = str(colour[3])
-                    self.colours[hex_colour] = [brickcolour, [index]]
-                    if not has_transparency and colour[3] > 0 and colour[3] > 255:
-                        has_transparency = True
-                    if is_invisible and colour[3] > 0:
-                        is_invisible = False
+                brickcolour = Brickcolour(hex_colour[:7], alpha=str(colour[3]))
+                self.colours[hex_colour] = [brickcolour, colour_summary.get_face_indices(colour_index)]
+            is_invisible = not np.any(colour_summary.colours[:, 3] > 0)
             if len(self.colours) > 1:
                 self.multicolour = True
                 if main_colour is None:
@@ -474,7 +627,7 @@ class Subpart:
                     self.main_colour = self.colours.popitem()[1][0]
             if is_invisible:
                 for key, value in self.colours.items():
-                    value[0].alpha = "255"
+                    value[0] = Brickcolour(value[0].colour_code, alpha="255")
                     self.apply_color(key=key)
 
     def _colour_from_dict(self, colours: OrderedDict, main_colour: Brickcolour):
@@ -517,10 +670,12 @@ class Subpart:
         for key in self.colours:
             colour = self.colours[key][0]
             if colour.colour_code in new_colours:
-                new_colours[colour.colour_code][1].extend(self.colours[key][1])
+                new_colours[colour.colour_code][1] = np.concatenate(
+                    (new_colours[colour.colour_code][1], self.colours[key][1]))
             else:
                 new_colours[colour.colour_code] = [colour, self.colours[key][1]]
         self.colours = new_colours
+        self._invalidate_rendering()
         if apply_after:
             for key in self.colours:
                 self.apply_color(key=key)
@@ -528,26 +683,34 @@ class Subpart:
             self.multicolour = False
             self.main_colour = self.colours.popitem()[1][0]
 
-    def map_to_ldraw_colours(self, included_colour_categories):
-        colourlist = get_all_brickcolours(included_colour_categories)
+    def map_to_ldraw_colours(self, included_colour_categories, colour_matcher: ColourMatcher = None,
+                             metric: ColourMetric = ColourMetric.RGB):
+        """
+        :param colour_matcher:
+            matcher of the included colour categories, created with the metric if None
+        """
+        if colour_matcher is None:
+            colour_matcher = get_colour_matcher(included_colour_categories, metric=metric)
         if self.multicolour:
-            for key in self.colours:
-                if self.colours[key][0].colour_type == "Direct":
-                    rgb_values = self.colours[key][0].rgb_values
-                    mappedcolor = get_closest_brickcolour_by_rgb_colour(rgb_values, colourlist)
+            direct_keys = [key for key in self.colours if self.colours[key][0].colour_type == "Direct"]
+            if len(direct_keys) > 0:
+                # All colours are matched in one call
+                mappedcolors = colour_matcher.get_closest_brickcolours(
+                    [self.colours[key][0].rgb_values for key in direct_keys])
+                for key, mappedcolor in zip(direct_keys, mappedcolors):
                     self.colours[key][0] = mappedcolor
             self.merge_duplicate_colours(True)
         elif self.main_colour.colour_type != "LDraw":
             rgb_values = self.main_colour.rgb_values
-            mappedcolor = get_closest_brickcolour_by_rgb_colour(rgb_values, colourlist)
+            mappedcolor = colour_matcher.get_closest_brickcolour(rgb_values)
             self.apply_color(mappedcolor)
 
-    def convert_to_dat_file(self, filepath, main_file_name, author, license_line):
+    def convert_to_dat_file(self, filepath, main_file_name, author, license_line, precision: int = None):
         filename = fr"s\{os.path.basename(filepath)}"
         header = self.get_ldraw_header(filename, main_file_name, author, license_line)
-        with open(filepath, "w", encoding="utf-8") as file:
+        with ResultWriter(filepath) as file:
             file.write(header)
-            for line in self.to_ldraw_lines():
+            for line in self.to_ldraw_lines(precision=precision):
                 file.write(line)
 
     def get_ldraw_header(self, filename, main_file_name, author, license_line, define_colours=False):
@@ -567,38 +730,120 @@ class Subpart:
                   f"0 BFC CERTIFY CCW\n")
         return header
 
-    def to_ldraw_lines(self, color_code="16", apply_transform=False):
-        vertices = self.mesh.vertices
+    def to_ldraw_lines(self, color_code="16", apply_transform=False, precision: int = None):
+        """
+        Yields the LDraw lines of the subpart.
+        The lines are rendered in bulk, every yielded string contains a chunk of lines.
+        :param precision:
+            number of decimals of the coordinates, trailing zeros are removed.
+            None writes the coordinates with full float precision
+        """
+        # The coordinates of every colour group are cached without line type and colour code
+        # until the faces of the group are changed, a new colour only changes the prefix of the lines
+        # Only the lines of the last used (apply_transform, precision) are kept
+        render_key = (apply_transform, precision)
+        if render_key not in self._rendered_lines:
+            self._rendered_lines.clear()
+        rendered_groups = self._rendered_lines.setdefault(render_key, {})
+        if self.multicolour:
+            groups = [(key, f"3 {colour.colour_code}") for key, (colour, _) in self.colours.items()]
+        else:
+            groups = [(None, f"3 {color_code}")]
+        if len(self.outlines) > 0:
+            groups.append(("outlines", "2 24"))
+        vertex_strings = None
+        for group_key, prefix in groups:
+            if group_key not in rendered_groups:
+                if vertex_strings is None:
+                    # Every vertex is only formatted once, lines are assembled from the vertex strings
+                    vertex_strings = _format_vertices(self._get_vertices(apply_transform), precision)
+                if group_key is None:
+                    indices = self.mesh.faces
+                elif group_key == "outlines":
+                    indices = self.outlines
+                else:
+                    indices = self.mesh.faces[self.colours[group_key][1]]
+                rendered_groups[group_key] = list(_format_lines("", vertex_strings, indices))
+            for coordinates in rendered_groups[group_key]:
+                yield _prefix_lines(prefix, coordinates)
+
+    def _get_vertices(self, apply_transform=False) -> np.ndarray:
         if apply_transform and not is_identity_matrix(self.transformation_matrix):
             if self.vertices_with_transform is None:
                 self.vertices_with_transform = trimesh.transformations.transform_points(
                     self.mesh.vertices.copy(),
                     self.transformation_matrix,
                     True)
-            vertices = self.vertices_with_transform
+            return self.vertices_with_transform
+        return self.mesh.vertices
+
+    def _invalidate_rendering(self, group_key=None):
+        """
+        Removes cached lines of the colour group with the key from self.colours,
+        "outlines" or None for all groups
+        """
+        if group_key is None:
+            self._rendered_lines.clear()
+            return
+        for rendered_groups in self._rendered_lines.values():
+            rendered_groups.pop(group_key, None)
+
+    def get_geometry_hash(self) -> str:
+        """
+        Hash of the vertices, faces, colour groups and outlines.
+        Subparts with the same hash have the same LDraw lines if written with the same colour code.
+        """
+        geometry_hash = hashlib.blake2b()
+        arrays = [self.mesh.vertices, self.mesh.faces, np.asarray(self.outlines, dtype=np.int64).reshape(-1, 2)]
         if self.multicolour:
             for colour, faces in self.colours.values():
-                code = colour.colour_code
-                for index in faces:
-                    face = self.mesh.faces[index]
-                    coordinate_a = ' '.join(map(str, vertices[face[0]]))
-                    coordinate_b = ' '.join(map(str, vertices[face[1]]))
-                    coordinate_c = ' '.join(map(str, vertices[face[2]]))
-                    yield f"3 {code} {coordinate_a} {coordinate_b} {coordinate_c}\n"
+                geometry_hash.update(f"{colour.colour_code};".encode("utf-8"))
+                arrays.append(faces)
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            geometry_hash.update(f"{array.dtype.str}{array.shape};".encode("utf-8"))
+            geometry_hash.update(array)
+        return geometry_hash.hexdigest()
+
+    def _get_colour_groups(self, color_code="16") -> list[tuple[str, np.ndarray | None]]:
+        """Colour code and face indices of every colour group, None includes all faces"""
+        if self.multicolour:
+            return [(colour.colour_code, faces) for colour, faces in self.colours.values()]
+        return [(color_code, None)]
+
+    def submit_rendering(self, pool: ProcessPoolExecutor, header: str, precision: int = None,
+                         filepath: str = None) -> tuple[Future, SharedMemory]:
+        """
+        Renders the LDraw lines of the subpart in a worker process.
+        The mesh arrays are passed to the worker in shared memory.
+        :param header:
+            written before the lines
+        :param filepath:
+            file the worker writes the result to, if None the future returns the text
+        :return:
+            future of the worker and the shared memory,
+            which has to be closed and unlinked when the future is done
+        """
+        colour_groups = self._get_colour_groups()
+        grouped_faces = [faces for _, faces in colour_groups if faces is not None]
+        if len(grouped_faces) > 0:
+            grouped_faces = np.concatenate(grouped_faces)
         else:
-            for face in self.mesh.faces:  # faces vertices
-                coordinate_a = ' '.join(map(str, vertices[face[0]]))
-                coordinate_b = ' '.join(map(str, vertices[face[1]]))
-                coordinate_c = ' '.join(map(str, vertices[face[2]]))
-                yield f"3 {color_code} {coordinate_a} {coordinate_b} {coordinate_c}\n"
-        for outline in self.outlines:
-            yield (f"2 24 {vertices[outline[0]][0]} {vertices[outline[0]][1]} {vertices[outline[0]][2]} "
-                   f"{vertices[outline[1]][0]} {vertices[outline[1]][1]} {vertices[outline[1]][2]}\n")
+            grouped_faces = np.empty(0, dtype=np.int64)
+        outlines = np.asarray(self.outlines, dtype=np.int64).reshape(-1, 2)
+        memory, specs = _create_shared_arrays([self.mesh.vertices, self.mesh.faces, grouped_faces, outlines])
+        # Face indices are replaced by their number, the worker splits the grouped faces again
+        group_sizes = [(code, None if faces is None else len(faces)) for code, faces in colour_groups]
+        future = pool.submit(_render_shared_subpart, memory.name, specs, group_sizes, header, precision, filepath)
+        return future, memory
 
     def generate_outlines(self, angle_threshold=85, merge_vertices=False):
         mesh = self.mesh
         if merge_vertices:
             self.mesh.merge_vertices()
+            # Vertices and faces of all colour groups are changed
+            self.vertices_with_transform = None
+            self._invalidate_rendering()
         edges = mesh.face_adjacency_angles >= np.radians(angle_threshold)
         self.outlines = mesh.face_adjacency_edges[edges]
 
@@ -612,7 +857,8 @@ class Subpart:
         split_subparts = []
         for group, split_keys in enumerate(keys):
             colours = OrderedDict()
-            faces = []
+            face_groups = []
+            face_count = 0
             outlines = None
             for colour_key in split_keys:
                 if colour_key == "outlines":
@@ -620,14 +866,17 @@ class Subpart:
                 else:
                     if colour_key not in self.colours:
                         raise ValueError(f"Colour key '{colour_key}' not in subpart.colours")
-                    face_count = len(faces)
                     coloured_count = len(self.colours[colour_key][1])
                     colours[colour_key] = [
                         self.colours[colour_key][0],
-                        list(range(face_count, face_count+coloured_count))
+                        np.arange(face_count, face_count+coloured_count)
                     ]
-                    for face_index in self.colours[colour_key][1]:
-                        faces.append(self.mesh.faces[face_index])
+                    face_groups.append(self.colours[colour_key][1])
+                    face_count += coloured_count
+            if len(face_groups) > 0:
+                faces = self.mesh.faces[np.concatenate(face_groups)]
+            else:
+                faces = []
 
             new_geometry = Trimesh(vertices=self.mesh.vertices, faces=faces)
             node_key = parent.scene.add_geometry(new_geometry, transform=self.transformation_matrix)
@@ -647,44 +896,306 @@ class Subpart:
             split_subparts.append(new_subpart)
         parent.delete_subpart(self)
         parent.subparts.extend(split_subparts)
+        self._invalidate_rendering()
         return split_subparts
 
 
 class ResultWriter:
-    def __init__(self, filepath: str = None):
-        self._is_file_writer = filepath is not None
-        self.filepath = filepath
+    def __init__(self, file=None, binary: bool = None, chunk_size: int = 1 << 20):
+        """
+        Collects the written text in a buffer and writes it to the file in large chunks
+        :param file:
+            filepath, file-like object with a write method (e.g. a pipe or socket.makefile("wb"))
+            or None to collect the result in memory
+        :param binary:
+            write utf-8 encoded bytes to the file object, detected from the file object if None
+        :param chunk_size:
+            number of characters collected before they are written to the file
+        """
+        self.file = file
+        self.binary = binary
+        self.chunk_size = chunk_size
+        self._is_file_writer = file is not None
+        self._opens_file = isinstance(file, (str, os.PathLike))
+        self._target = None
+        self._buffer = io.StringIO()
 
     def __enter__(self):
-        if self._is_file_writer:
-            self._result = open(self.filepath, "w", encoding="utf-8")
-        else:
-            self._result = []
+        if self._opens_file:
+            self._target = open(self.file, "w", encoding="utf-8")
+            self.binary = False
+        elif self._is_file_writer:
+            self._target = self.file
+            if self.binary is None:
+                self.binary = not isinstance(self._target, io.TextIOBase)
+        self._buffer.seek(0)
+        self._buffer.truncate()
         return self
 
     def __exit__(self, *args):
         if self._is_file_writer:
-            self._result.close()
+            self.flush()
+            if self._opens_file:
+                self._target.close()
 
     def write(self, lines: str):
-        if self._is_file_writer:
-            self._result.write(lines)
-        else:
-            self._result.append(lines)
+        if self._is_file_writer and len(lines) >= self.chunk_size:
+            # Large blocks are written directly instead of being copied into the buffer
+            self.flush()
+            self._write_to_target(lines)
+            return
+        self._buffer.write(lines)
+        if self._is_file_writer and self._buffer.tell() >= self.chunk_size:
+            self.flush()
 
     def write_list(self, lines: list):
-        if self._is_file_writer:
-            for line in lines:
-                self._result.write(line)
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Writes the buffered text to the file"""
+        if not self._is_file_writer or self._buffer.tell() == 0:
+            return
+        self._write_to_target(self._buffer.getvalue())
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def _write_to_target(self, text: str):
+        if self.binary:
+            self._target.write(text.encode("utf-8"))
         else:
-            self._result.extend(lines)
+            self._target.write(text)
 
     def get_result(self):
         if not self._is_file_writer:
-            return "".join(self._result)
+            return self._buffer.getvalue()
         return None
 
 
+class ColourSummary:
+    def __init__(self, visual):
+        """
+        Distinct face colours of a geometry, all computed with a single np.unique of the packed RGBA values
+        :param visual:
+            ColorVisuals of the geometry
+        """
+        face_colours = np.ascontiguousarray(visual.face_colors, dtype=np.uint8).reshape(-1, 4)
+        packed_colours = face_colours.view(np.uint32).reshape(-1)
+        _, self.first_indices, self.inverse, self.counts = np.unique(
+            packed_colours, return_index=True, return_inverse=True, return_counts=True)
+        # Same order as the unique rows of trimesh (sorted by alpha, blue, green, red)
+        self.colours = face_colours[self.first_indices]
+        self._face_order = None
+        self._group_ends = None
+        if len(self.counts) == 0:
+            self.main_colour = np.array([102, 102, 102, 255], dtype=np.uint8)
+        elif visual.kind == "face":
+            self.main_colour = self.colours[np.argmax(self.counts)]
+        else:
+            self.main_colour = visual.main_color
+
+    @property
+    def single_colour(self) -> bool:
+        return len(self.colours) <= 1
+
+    def only_contains(self, colour) -> bool:
+        return self.single_colour and bool(np.all(self.colours == colour))
+
+    def get_face_indices(self, colour_index: int) -> np.ndarray:
+        """Returns the indices of all faces with the colour at colour_index in ascending order"""
+        if self._face_order is None:
+            self._face_order = np.argsort(self.inverse, kind="stable")
+            self._group_ends = np.cumsum(self.counts)
+        end = self._group_ends[colour_index]
+        return self._face_order[end - self.counts[colour_index]:end]
+
+
+def get_colour_summary(geometry: Trimesh) -> ColourSummary:
+    """
+    Returns the colour summary of the geometry.
+    It is cached on the geometry until the colours are changed.
+    """
+    visual_hash = hash(geometry.visual)
+    cached = getattr(geometry, "colour_summary", None)
+    if cached is None or cached[0] != visual_hash:
+        cached = (visual_hash, ColourSummary(geometry.visual))
+        geometry.colour_summary = cached
+    return cached[1]
+
+
+def _sample_texture_at_faces(geometry: Trimesh) -> np.ndarray | None:
+    """
+    Samples the texture of a geometry with TextureVisuals at the uv coordinates of the face centroids
+    :return: face colours or None if the geometry has no texture
+    """
+    visual = geometry.visual
+    if visual.uv is None or len(visual.uv) != len(geometry.vertices):
+        return None
+    if isinstance(visual.material, trimesh.visual.material.PBRMaterial):
+        texture = visual.material.baseColorTexture
+    else:
+        texture = getattr(visual.material, "image", None)
+    if texture is None:
+        return None
+    face_uv = visual.uv[geometry.faces].mean(axis=1)
+    return visual.material.to_color(face_uv)
+
+
+_line_chunk_size = 65536
+
+
+def _format_numbers(values: np.ndarray, precision: int) -> np.ndarray:
+    """
+    Formats numbers with a fixed number of decimals without trailing zeros,
+    values that round to an integer are written as integer (e.g. 12.499999999999998 -> 12.5, 2.0000001 -> 2).
+    Values are rounded as integers in units of the last decimal, so every distinct value is only formatted once.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10 ** precision
+    scaled = np.rint(values * scale)
+    if not np.all(np.abs(scaled) < 2 ** 53):
+        # Not representable as integers (inf, nan or too large)
+        strings = np.empty(values.shape, dtype=object)
+        strings.ravel()[:] = [_format_float(value, precision) for value in values.ravel().tolist()]
+        return strings
+    unique_values, inverse = np.unique(scaled.astype(np.int64), return_inverse=True)
+    unique_strings = np.empty(len(unique_values), dtype=object)
+    unique_strings[:] = [_format_scaled_integer(value, scale, precision) for value in unique_values.tolist()]
+    return unique_strings[inverse.reshape(values.shape)]
+
+
+def _format_float(value: float, precision: int) -> str:
+    if not np.isfinite(value):
+        return str(value)
+    string = f"{value:.{precision}f}"
+    if "." in string:
+        string = string.rstrip("0").rstrip(".")
+    if string == "-0":
+        string = "0"
+    return string
+
+
+def _format_scaled_integer(value: int, scale: int, precision: int) -> str:
+    sign = "-" if value < 0 else ""
+    integer_part, decimals = divmod(abs(value), scale)
+    if decimals == 0:
+        return f"{sign}{integer_part}"
+    return f"{sign}{integer_part}.{decimals:0{precision}d}".rstrip("0")
+
+
+def _format_vertices(vertices: np.ndarray, precision: int = None) -> np.ndarray:
+    """
+    Formats every vertex as "x y z"
+    Without precision repr of the python floats is used, which is identical to str of the numpy floats
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    vertex_strings = np.empty(len(vertices), dtype=object)
+    if precision is None:
+        x, y, z = vertices.T.tolist()
+        vertex_strings[:] = list(map("{!r} {!r} {!r}".format, x, y, z))
+    else:
+        x, y, z = _format_numbers(vertices, precision).T.tolist()
+        vertex_strings[:] = list(map("{} {} {}".format, x, y, z))
+    return vertex_strings
+
+
+def _format_lines(prefix: str, vertex_strings: np.ndarray, indices):
+    """
+    Renders one line per row of vertex indices, the lines are yielded in chunks
+    :param prefix:
+        line type and colour code like "3 16"
+    :param indices:
+        (n, 2) for lines or (n, 3) for triangles
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    # Lines are rendered in chunks to limit the size of the temporary arrays
+    for start in range(0, len(indices), _line_chunk_size):
+        chunk = indices[start:start + _line_chunk_size]
+        # Every line consists of the prefix, the vertex strings with separators and the line break
+        parts = np.empty((len(chunk), 2 * chunk.shape[1] + 2), dtype=object)
+        parts[:, 0] = prefix
+        parts[:, 1:-1:2] = " "
+        parts[:, 2:-1:2] = vertex_strings[chunk]
+        parts[:, -1] = "\n"
+        yield "".join(parts.ravel().tolist())
+
+
+def _prefix_lines(prefix: str, lines: str) -> str:
+    """Puts the prefix in front of every line, the lines have to start with a space"""
+    return prefix + lines.replace("\n", f"\n{prefix}", lines.count("\n") - 1)
+
+
+def _render_ldraw_lines(vertices, faces, colour_groups, outlines, precision: int = None):
+    """
+    Yields the triangle lines of every colour group followed by the outlines
+    :param colour_groups:
+        list of colour codes and face indices, None includes all faces
+    """
+    # Every vertex is only formatted once, lines are assembled from the vertex strings
+    vertex_strings = _format_vertices(vertices, precision)
+    for colour_code, group_faces in colour_groups:
+        if group_faces is not None:
+            group_faces = faces[group_faces]
+        else:
+            group_faces = faces
+        yield from _format_lines(f"3 {colour_code}", vertex_strings, group_faces)
+    if len(outlines) > 0:
+        yield from _format_lines("2 24", vertex_strings, outlines)
+
+
+def _create_shared_arrays(arrays):
+    """
+    Copies the arrays into one shared memory block
+    :return:
+        the shared memory and the shape, dtype and offset of every array
+    """
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    specs = []
+    size = 0
+    for array in arrays:
+        # Offsets are aligned to 8 bytes
+        size = (size + 7) // 8 * 8
+        specs.append((array.shape, array.dtype.str, size))
+        size += array.nbytes
+    memory = SharedMemory(create=True, size=max(size, 1))
+    for array, (shape, dtype, offset) in zip(arrays, specs):
+        np.ndarray(shape, dtype, buffer=memory.buf, offset=offset)[...] = array
+    return memory, specs
+
+
+def _render_shared_subpart(memory_name: str, specs, group_sizes, header: str, precision: int = None,
+                           filepath: str = None):
+    """
+    Worker function of Subpart.submit_rendering, renders the subpart from shared memory
+    :param group_sizes:
+        colour code and number of faces of every colour group, None includes all faces
+    :return:
+        the rendered text, empty if it was written to filepath
+    """
+    memory = SharedMemory(name=memory_name)
+    try:
+        vertices, faces, grouped_faces, outlines = [np.ndarray(shape, dtype, buffer=memory.buf, offset=offset)
+                                                    for shape, dtype, offset in specs]
+        colour_groups = []
+        start = 0
+        for colour_code, size in group_sizes:
+            if size is None:
+                colour_groups.append((colour_code, None))
+            else:
+                colour_groups.append((colour_code, grouped_faces[start:start + size]))
+                start += size
+        with ResultWriter(filepath) as file:
+            file.write(header)
+            for lines in _render_ldraw_lines(vertices, faces, colour_groups, outlines, precision):
+                file.write(lines)
+            result = file.get_result() if filepath is None else ""
+        # The views have to be released before the memory can be closed
+        del vertices, faces, grouped_faces, outlines, colour_groups
+    finally:
+        memory.close()
+    return result
+
+
 def rgba_to_hex(color):
     def __color_to_hex(number: int):
         if number == 0:
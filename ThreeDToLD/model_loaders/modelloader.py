@@ -1,19 +1,67 @@
+import io
+import mmap
 from trimesh.scene.scene import Scene
 from abc import ABC, abstractmethod
 
 
+class _MappedFile(io.RawIOBase):
+    """File object reading from a memory-mapped file, copying the data straight from the map into the buffers"""
+
+    def __init__(self, mapped_file: mmap.mmap):
+        super().__init__()
+        self.mapped_file = mapped_file
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        # The views are released after reading, otherwise the map can't be closed
+        with memoryview(buffer) as target, memoryview(self.mapped_file) as view:
+            start = self.mapped_file.tell()
+            end = min(start + target.nbytes, len(view))
+            if end <= start:
+                return 0
+            target.cast("B")[:end - start] = view[start:end]
+        self.mapped_file.seek(end)
+        return end - start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.mapped_file.seek(offset, whence)
+        return self.mapped_file.tell()
+
+    def tell(self):
+        return self.mapped_file.tell()
+
+
+def as_file_object(file):
+    """
+    Wraps file content given as bytes or memory-mapped file in a file object,
+    filepaths and file objects are returned unchanged
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return io.BytesIO(file)
+    if isinstance(file, mmap.mmap):
+        return _MappedFile(file)
+    return file
+
+
 class Modelloader(ABC):
 
     def __init__(self):
         pass
 
     @abstractmethod
-    def load_model(self, file) -> tuple[Scene, dict]:
+    def load_model(self, file, file_type: str = None) -> tuple[Scene, dict]:
         """
         Loader used to load a 3D model from file
         :param file:
             file to load 3D model from
-            normally a filepath, could also be a file object
+            a filepath, a file object, a memory-mapped file or the file content as bytes
+        :param file_type:
+            file extension like "stl", required if file is not a filepath
         :return Scene, dict:
             returns a Trimesh Scene and a dictionary with metadata values
         """
@@ -1,11 +1,14 @@
 from trimesh.scene.scene import Scene
 from trimesh.base import Trimesh
+from trimesh.util import unique_name
 from zipfile import ZipFile
+from concurrent.futures import ProcessPoolExecutor, Future
 from lxml import etree
 import numpy as np
+import json
 import re
 from ThreeDToLD.appexcetions import Missing3mfElementError
-from ThreeDToLD.model_loaders.modelloader import Modelloader
+from ThreeDToLD.model_loaders.modelloader import Modelloader, as_file_object
 from ThreeDToLD.matrix_functions import is_identity_matrix
 
 
@@ -48,21 +51,341 @@ def _combine_transforms(transform_a: str | list, transform_b: str | list) -> str
     return result
 
 
-def _hex_to_rgba_colour(hexcolour: str):
-    hexcolour = "".join(re.findall("[a-f,A-F,0-9]", hexcolour))
-    r = int(hexcolour[0:2], 16)
-    g = int(hexcolour[2:4], 16)
-    b = int(hexcolour[4:6], 16)
-    if len(hexcolour) >= 8:
-        a = int(hexcolour[6:8], 16)
+_hex_colour_pattern = re.compile("^[0-9a-fA-F]{6}([0-9a-fA-F]{2})?$")
+
+
+def _hex_to_rgba_palette(hexcolours: list[str]) -> np.ndarray:
+    """
+    Converts hex colours like "#RRGGBB" or "#RRGGBBAA" to an (N, 4) uint8 array.
+    Invalid entries get the default trimesh colour.
+    """
+    colours = [colour.strip().strip('"').lstrip("#") for colour in hexcolours]
+    colours = [colour + "FF" if len(colour) == 6 else colour for colour in colours]
+    # Every colour needs 8 digits, otherwise the following colours would be shifted
+    if all(len(colour) == 8 for colour in colours):
+        try:
+            palette = np.frombuffer(bytes.fromhex("".join(colours)), dtype=np.uint8).reshape(-1, 4)
+            if len(palette) == len(colours):
+                return palette.copy()
+        except ValueError:
+            pass
+    # At least one colour is invalid, only these are replaced
+    colours = [colour if _hex_colour_pattern.match(colour) else "666666FF" for colour in colours]
+    return np.frombuffer(bytes.fromhex("".join(colours)), dtype=np.uint8).reshape(-1, 4).copy()
+
+
+_slic3rpe_namespace = "http://schemas.slic3r.org/3mf/2017/06"
+
+_xpaths = {}
+
+
+def _get_xpath(element, path: str) -> etree.XPath:
+    """
+    Returns a compiled XPath for children of the given element.
+    The prefix "c:" is bound to the namespace of the element, "s:" to the PrusaSlicer namespace.
+    """
+    namespace = etree.QName(element).namespace
+    key = (namespace, path)
+    if key not in _xpaths:
+        if namespace is None:
+            _xpaths[key] = etree.XPath(path.replace("c:", ""), namespaces={"s": _slic3rpe_namespace},
+                                       smart_strings=False)
+        else:
+            _xpaths[key] = etree.XPath(path, namespaces={"c": namespace, "s": _slic3rpe_namespace},
+                                       smart_strings=False)
+    return _xpaths[key]
+
+
+def _read_attribute_column(element, path: str, dtype, count: int) -> np.ndarray:
+    values = _get_xpath(element, path)(element)
+    if len(values) != count:
+        raise Missing3mfElementError(f"Not every element has the attribute {path.split('@')[-1]}")
+    if dtype == np.float64:
+        return np.fromiter(map(float, values), dtype=dtype, count=count)
+    return np.fromiter(map(int, values), dtype=dtype, count=count)
+
+
+# Value of every hex digit in ascii, other characters are read as 0
+_hex_nibbles = np.zeros(256, dtype=np.uint8)
+for _digit in "0123456789abcdef":
+    _hex_nibbles[ord(_digit)] = int(_digit, 16)
+    _hex_nibbles[ord(_digit.upper())] = int(_digit, 16)
+
+# Area share of the children of a split triangle in serialized order, row is the number of children
+# (Children are serialized in reverse order, a triangle split at two sides has the half sized child last)
+_child_area_shares = np.array([[1.0, 0.0, 0.0, 0.0],
+                               [1.0, 0.0, 0.0, 0.0],
+                               [0.5, 0.5, 0.0, 0.0],
+                               [0.5, 0.25, 0.25, 0.0],
+                               [0.25, 0.25, 0.25, 0.25]])
+
+# Highest state a leaf can have (4 bit value + 3)
+_max_paint_state = 18
+
+
+def _decode_paint_trees(nibbles: np.ndarray, positions: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """
+    Decodes subdivided triangles, all trees are read in parallel one node per step.
+    Every tree has a stack of its open split triangles with their area and their remaining children,
+    the stack entries of a tree are at tree * stack_size + level.
+    :return: state with the largest area of every tree
+    """
+    count = len(positions)
+    positions = positions.copy()
+    depths = np.zeros(count, dtype=np.int64)
+    stack_size = 16
+    totals = np.zeros(count * stack_size, dtype=np.int64)
+    remaining = np.zeros(count * stack_size, dtype=np.int64)
+    areas = np.zeros(count * stack_size, dtype=np.float64)
+    vote_indices = []
+    vote_areas = []
+
+    # The root of every tree is split
+    trees = np.arange(count)
+    codes = nibbles[positions]
+    totals[trees * stack_size] = (codes & 0b11) + 1
+    remaining[trees * stack_size] = (codes & 0b11) + 1
+    areas[trees * stack_size] = 1.0
+    depths[:] = 1
+    positions += 1
+    trees = trees[positions < stops]
+
+    while len(trees) > 0:
+        codes = nibbles[positions[trees]]
+        parents = trees * stack_size + depths[trees] - 1
+        parent_totals = totals[parents]
+        # Area of the current node as share of the whole triangle
+        node_areas = areas[parents] * _child_area_shares[parent_totals, parent_totals - remaining[parents]]
+
+        split_sides = codes & 0b11
+        is_split = split_sides > 0
+
+        # Split triangles are pushed to the stack, their children follow
+        split_trees = trees[is_split]
+        if len(split_trees) > 0:
+            if depths[split_trees].max() >= stack_size:
+                totals, remaining, areas = (np.pad(stack.reshape(count, stack_size), ((0, 0), (0, stack_size))).ravel()
+                                            for stack in (totals, remaining, areas))
+                stack_size *= 2
+                parents = trees * stack_size + depths[trees] - 1
+            entries = parents[is_split] + 1
+            totals[entries] = split_sides[is_split] + 1
+            remaining[entries] = split_sides[is_split] + 1
+            areas[entries] = node_areas[is_split]
+            depths[split_trees] += 1
+            positions[split_trees] += 1
+
+        # Leaves add their area to their state
+        is_leaf = ~is_split
+        leaf_trees = trees[is_leaf]
+        if len(leaf_trees) > 0:
+            leaf_codes = codes[is_leaf]
+            leaf_states = (leaf_codes >> 2).astype(np.int64)
+            extended = (leaf_codes & 0b1100) == 0b1100
+            leaf_states[extended] = nibbles[positions[leaf_trees[extended]] + 1] + 3
+            positions[leaf_trees] += 1 + extended
+            vote_indices.append(leaf_trees * (_max_paint_state + 1) + leaf_states)
+            vote_areas.append(node_areas[is_leaf])
+
+            # Close all split triangles whose last child was read
+            closing = leaf_trees
+            while len(closing) > 0:
+                entries = closing * stack_size + depths[closing] - 1
+                remaining[entries] -= 1
+                closing = closing[remaining[entries] == 0]
+                depths[closing] -= 1
+                closing = closing[depths[closing] > 0]
+
+        # Trees are finished when the stack is empty, truncated strings stop at their end
+        trees = trees[(depths[trees] > 0) & (positions[trees] < stops[trees])]
+
+    if len(vote_indices) == 0:
+        return np.zeros(count, dtype=np.int64)
+    votes = np.bincount(np.concatenate(vote_indices), weights=np.concatenate(vote_areas),
+                        minlength=count * (_max_paint_state + 1))
+    return np.argmax(votes.reshape(count, _max_paint_state + 1), axis=1)
+
+
+def _decode_paint_states(paint: list[str]) -> np.ndarray:
+    """
+    Decodes the triangle painting of PrusaSlicer (mmu_segmentation) and Bambu Studio (paint_color).
+    Every string is a serialized subdivision tree of the triangle, its hex digits are read from the end.
+    The lower two bits of a digit are the number of split sides, the children of split triangles follow.
+    Leaves have their state in the upper two bits, for states from 3 on these bits are set
+    and the next digit is the state - 3.
+    Subdivided triangles get the state with the largest area.
+    :return: state of every triangle, 0 is not painted, otherwise the number of the extruder
+    """
+    count = len(paint)
+    states = np.zeros(count, dtype=np.int64)
+    lengths = np.fromiter(map(len, paint), dtype=np.int64, count=count)
+    # Reversing all strings at once reverses the order of the strings as well
+    # An additional 0 at the end prevents reading past the array with truncated strings
+    nibbles = np.append(_hex_nibbles[np.frombuffer("".join(paint).encode("ascii", errors="replace"),
+                                                   dtype=np.uint8)][::-1], 0)
+    stops = len(nibbles) - 1 - np.cumsum(lengths) + lengths
+    positions = stops - lengths
+
+    painted = np.flatnonzero(lengths > 0)
+    codes = nibbles[positions[painted]]
+    # Most triangles are not subdivided and consist of a single leaf
+    is_leaf = (codes & 0b11) == 0
+    leaves = painted[is_leaf]
+    leaf_codes = codes[is_leaf]
+    states[leaves] = leaf_codes >> 2
+    extended = (leaf_codes & 0b1100) == 0b1100
+    states[leaves[extended]] = nibbles[positions[leaves[extended]] + 1] + 3
+
+    trees = painted[~is_leaf]
+    if len(trees) > 0:
+        states[trees] = _decode_paint_trees(nibbles, positions[trees], stops[trees])
+    return states
+
+
+def _read_paint_states(triangles, count: int) -> np.ndarray | None:
+    """
+    Reads the slicer painting of the triangles
+    :return: state of every triangle (see _decode_paint_states) or None if no triangle is painted
+    """
+    for attribute, key in (("s:mmu_segmentation", f"{{{_slic3rpe_namespace}}}mmu_segmentation"),
+                           ("paint_color", "paint_color")):
+        paint = _get_xpath(triangles, f"c:triangle/@{attribute}")(triangles)
+        if len(paint) == 0:
+            continue
+        if len(paint) != count:
+            # Only some triangles are painted
+            paint = [triangle.get(key, "") for triangle in _get_xpath(triangles, "c:triangle")(triangles)]
+        return _decode_paint_states(paint)
+    return None
+
+
+def _read_vertices(vertices) -> np.ndarray:
+    count = int(_get_xpath(vertices, "count(c:vertex)")(vertices))
+    mesh_vertices = np.empty((count, 3), dtype=np.float64)
+    for column, axis in enumerate(("x", "y", "z")):
+        mesh_vertices[:, column] = _read_attribute_column(vertices, f"c:vertex/@{axis}", np.float64, count)
+    return mesh_vertices
+
+
+def _read_triangles(triangles) -> tuple[np.ndarray, np.ndarray | None, np.ndarray | None, np.ndarray | None]:
+    """
+    :return:
+        triangle vertex indices,
+        pid of every triangle ("" if the triangle has no own colour),
+        p1 of every triangle (None if no triangle has its own colour) and
+        slicer paint state of every triangle (None if no triangle is painted)
+    """
+    count = int(_get_xpath(triangles, "count(c:triangle)")(triangles))
+    mesh_triangles = np.empty((count, 3), dtype=np.int64)
+    for column, index in enumerate(("v1", "v2", "v3")):
+        mesh_triangles[:, column] = _read_attribute_column(triangles, f"c:triangle/@{index}", np.int64, count)
+
+    paint_states = _read_paint_states(triangles, count)
+
+    colour_count = int(_get_xpath(triangles, "count(c:triangle[@pid])")(triangles))
+    if colour_count == 0:
+        return mesh_triangles, None, None, paint_states
+    if colour_count == count:
+        pids = np.array(_get_xpath(triangles, "c:triangle/@pid")(triangles))
+        p1 = _read_attribute_column(triangles, "c:triangle/@p1", np.int64, count)
     else:
-        a = 255
-    return r, g, b, a
+        # Only some triangles have their own colour
+        triangle_elements = _get_xpath(triangles, "c:triangle")(triangles)
+        pids = np.array([triangle.get("pid", "") for triangle in triangle_elements])
+        p1 = np.fromiter((int(triangle.get("p1", 0)) for triangle in triangle_elements), dtype=np.int64, count=count)
+    return mesh_triangles, pids, p1, paint_states
+
+
+def _read_mesh(mesh) -> tuple:
+    vertices = np.empty((0, 3), dtype=np.float64)
+    triangles = np.empty((0, 3), dtype=np.int64)
+    pids = None
+    p1 = None
+    paint_states = None
+    for data in mesh.getchildren():
+        data_tag = _get_tag_type(data)
+        if data_tag == "vertices":
+            vertices = _read_vertices(data)
+        elif data_tag == "triangles":
+            triangles, pids, p1, paint_states = _read_triangles(data)
+    return vertices, triangles, pids, p1, paint_states
+
+
+def _read_mesh_part_xml(xml: bytes):
+    """Reads a serialized vertices or triangles element, used by the worker processes"""
+    element = etree.fromstring(xml)
+    if _get_tag_type(element) == "vertices":
+        return _read_vertices(element)
+    return _read_triangles(element)
+
+
+def _apply_slicer_colours(mesh_colours: np.ndarray, paint_states: np.ndarray | None, extruders: tuple | None,
+                          slicer_colours: np.ndarray):
+    """
+    Colours the triangles with the colour of their extruder
+    :param paint_states:
+        painted extruder of every triangle, 0 if not painted
+    :param extruders:
+        extruder of the object and its volumes as list of (first triangle, last triangle, extruder),
+        None if the object has no slicer settings
+    """
+    triangle_extruders = np.zeros(len(mesh_colours), dtype=np.int64)
+    if extruders is not None:
+        object_extruder, volumes = extruders
+        # Extruder 0 is the default extruder
+        triangle_extruders[:] = max(object_extruder, 1)
+        for first, last, extruder in volumes:
+            if extruder > 0:
+                triangle_extruders[first:last + 1] = extruder
+    if paint_states is not None:
+        painted = paint_states > 0
+        triangle_extruders[painted] = paint_states[painted]
+    coloured = (triangle_extruders > 0) & (triangle_extruders <= len(slicer_colours))
+    mesh_colours[coloured] = slicer_colours[triangle_extruders[coloured] - 1]
+
+
+def _create_geometry(vertices: np.ndarray, triangles: np.ndarray, pids: np.ndarray | None, p1: np.ndarray | None,
+                     paint_states: np.ndarray | None, base_colour, colour_groups: dict,
+                     extruders: tuple = None) -> Trimesh:
+    mesh_colours = np.empty((len(triangles), 4), dtype=np.uint8)
+    mesh_colours[:] = base_colour
+    if pids is not None:
+        for pid in np.unique(pids):
+            if pid == "":
+                continue
+            coloured = pids == pid
+            mesh_colours[coloured] = colour_groups[pid][p1[coloured]]
+    if "sc" in colour_groups and (paint_states is not None or extruders is not None):
+        _apply_slicer_colours(mesh_colours, paint_states, extruders, colour_groups["sc"])
+    return Trimesh(vertices=vertices, faces=triangles, face_colors=mesh_colours)
+
+
+def _create_geometry_from_xml(mesh_xml: bytes, base_colour, colour_groups: dict, extruders: tuple = None) -> Trimesh:
+    """Creates the geometry of a serialized mesh element, used by the worker processes"""
+    return _create_geometry(*_read_mesh(etree.fromstring(mesh_xml)), base_colour, colour_groups, extruders)
+
+
+def _get_result(value):
+    if isinstance(value, Future):
+        return value.result()
+    return value
 
 
 class Threemfloader(Modelloader):
 
-    def __init__(self):
+    def __init__(self, streaming: bool = False, workers: int = 1):
+        """
+        :param streaming:
+            parse the model file incrementally, mesh data is converted to arrays
+            and removed from the xml tree while parsing.
+            Keeps the memory usage low for very large 3mf files.
+        :param workers:
+            number of processes used to read and create the meshes,
+            speeds up files with many objects
+        """
+        self.streaming = streaming
+        self.workers = workers
+        self.pool: ProcessPoolExecutor = None
         self.was_reset = True
         self.model: Scene = Scene()
         self.metadata: dict = {}
@@ -77,17 +400,36 @@ class Threemfloader(Modelloader):
         self.is_slic3r_derivat: bool = False
         self.colour_groups = {}
         self.sub_models = {}
+        # Extruders from the slicer model config, key is the object id
+        # Values are the extruder of the object and a list of (first triangle, last triangle, extruder) of its volumes
+        self.object_extruders = {}
         self.meshes = []
+        # Mesh arrays already read while parsing (streaming mode), key is (object id, mesh index)
+        # Values are dictionaries with the vertices and triangles data or futures of the worker processes
+        self.mesh_data = {}
 
-    def load_model(self, filepath) -> tuple[Scene, dict]:
+    def load_model(self, file, file_type: str = None) -> tuple[Scene, dict]:
         if not self.was_reset:
-            self.__init__()
+            self.__init__(self.streaming, self.workers)
         self.was_reset = False
 
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            return self._load_model(as_file_object(file))
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+                self.pool = None
+
+    def _load_model(self, filepath) -> tuple[Scene, dict]:
         # Collect Data from 3mf file
         with ZipFile(filepath) as file_3mf:
             with file_3mf.open("3D/3dmodel.model", "r") as model_file:
-                model_3mf = etree.parse(model_file).getroot()
+                if self.streaming:
+                    model_3mf = self._parse_streaming(model_file)
+                else:
+                    model_3mf = etree.parse(model_file).getroot()
             if model_3mf.attrib.has_key("unit"):
                 self.unit = model_3mf.attrib["unit"]
             for element in model_3mf.getchildren():
@@ -127,28 +469,8 @@ class Threemfloader(Modelloader):
             # Get colours definitions from slicer configs
             if self.config_name is not None:
                 # Add colour group for slicer defined colours sc=slicer colour
-                self.colour_groups["sc"] = []
-                if self.vendor == "BambuStudio":
-                    with file_3mf.open(self.config_name) as config_file:
-                        in_colour_section = False
-                        for line in config_file.readlines():
-                            if in_colour_section and b'],' in line:
-                                break
-                            elif in_colour_section:
-                                self.colour_groups["sc"].append(_hex_to_rgba_colour(str(line).split('"')[1]))
-                            if b'"filament_colour":' in line:
-                                in_colour_section = True
-                elif self.is_slic3r_derivat:
-                    if self.config_name in file_3mf.namelist():
-                        with file_3mf.open(self.config_name) as config_file:
-                            for line in config_file.readlines():
-                                if b'extruder_colour' in line:
-                                    colours = str(line).split("= ")[1].split(";")
-                                    self.colour_groups["sc"] = str(line).split("= ")[1].split(";")
-                                    for colour in colours:
-                                        self.colour_groups["sc"].append(_hex_to_rgba_colour(colour))
-                                    break
-            if self.model_config_name is not None:
+                self.colour_groups["sc"] = _hex_to_rgba_palette(self._read_slicer_colours(file_3mf))
+            if self.model_config_name is not None and self.model_config_name in file_3mf.namelist():
                 with file_3mf.open(self.model_config_name) as model_config_file:
                     self.model_config = etree.parse(model_config_file).getroot()
         if self.resources is None and self.build is None:
@@ -164,12 +486,11 @@ class Threemfloader(Modelloader):
             resource_tag = _get_tag_type(resource)
             resource_id = resource.attrib["id"]
             if resource_tag in ["m:colorgroup", "basematerials", "colorgroup"]:
-                self.colour_groups[resource_id] = []
                 colour_key = "color"
                 if resource_tag == "basematerials":
                     colour_key = "displaycolor"
-                for colour in resource.getchildren():
-                    self.colour_groups[resource_id].append(_hex_to_rgba_colour(colour.attrib[colour_key]))
+                colours = _get_xpath(resource, f"c:*/@{colour_key}")(resource)
+                self.colour_groups[resource_id] = _hex_to_rgba_palette(colours)
             elif resource_tag == "object":
                 if resource.attrib["type"] != "model":
                     continue
@@ -185,21 +506,22 @@ class Threemfloader(Modelloader):
                 object_id = item.attrib["objectid"]
                 self.collect_object_meshes(object_id, transform, 0)
 
-        if self.is_slic3r_derivat:
-            # Todo: Split and Color Meshes according to slicer data and model_config
-            # Edit Mesh to use colorgroup
-            pass
+        if self.is_slic3r_derivat and self.model_config is not None:
+            self.object_extruders = self._read_object_extruders()
 
         # Create Trimesh geometries from mesh data
-        for mesh_data in self.meshes:
+        # Every mesh is only created once, instances of it share the geometry
+        # With worker processes the geometries are futures until all meshes are submitted
+        geometries = {}
+        instances = []
+        for parent_object, transform, index in self.meshes:
+            mesh_id = parent_object.attrib["id"]
+            instances.append(((mesh_id, index), transform))
+            if (mesh_id, index) in geometries:
+                continue
+
             # Default trimesh colour
             mesh_base_colour = (102, 102, 102, 255)
-            mesh_vertices = []
-            mesh_triangles = []
-            mesh_colours = []
-            parent_object = mesh_data[0]
-            mesh_id = parent_object.attrib["id"]
-            mesh = parent_object.getchildren()[mesh_data[2]]
             mesh_name = f"object_{mesh_id}"
 
             if parent_object.attrib.has_key("name"):
@@ -208,41 +530,119 @@ class Threemfloader(Modelloader):
             if parent_object.attrib.has_key("pid"):
                 mesh_base_colour = self.colour_groups[parent_object.attrib["pid"]][int(parent_object.attrib["pindex"])]
 
-            for data in mesh.getchildren():
-                data_tag = _get_tag_type(data)
-                if data_tag == "vertices":
-                    for vertex in data.getchildren():
-                        if _get_tag_type(vertex) == "vertex":
-                            mesh_vertices.append((
-                                float(vertex.attrib["x"]),
-                                float(vertex.attrib["y"]),
-                                float(vertex.attrib["z"])
-                            ))
-                elif data_tag == "triangles":
-                    for triangle in data.getchildren():
-                        if _get_tag_type(triangle) == "triangle":
-                            mesh_triangles.append((
-                                int(triangle.attrib["v1"]),
-                                int(triangle.attrib["v2"]),
-                                int(triangle.attrib["v3"])
-                            ))
-                            if triangle.attrib.has_key("pid"):
-                                mesh_colours.append(self.colour_groups
-                                                    [triangle.attrib["pid"]]
-                                                    [int(triangle.attrib["p1"])]
-                                                    )
-                            else:
-                                mesh_colours.append(mesh_base_colour)
-            geometry = Trimesh(vertices=mesh_vertices, faces=mesh_triangles, face_colors=mesh_colours)
-            transform = _transform_to_matrix(mesh_data[1])
+            mesh_extruders = self.object_extruders.get(mesh_id)
+
+            if (mesh_id, index) in self.mesh_data:
+                mesh_parts = self.mesh_data[(mesh_id, index)]
+                mesh_vertices = _get_result(mesh_parts.get("vertices", np.empty((0, 3), dtype=np.float64)))
+                mesh_triangles, pids, p1, paint_states = _get_result(
+                    mesh_parts.get("triangles", (np.empty((0, 3), dtype=np.int64), None, None, None)))
+                geometry = _create_geometry(mesh_vertices, mesh_triangles, pids, p1, paint_states,
+                                            mesh_base_colour, self.colour_groups, mesh_extruders)
+            elif self.pool is not None:
+                geometry = self.pool.submit(_create_geometry_from_xml,
+                                            etree.tostring(parent_object.getchildren()[index]),
+                                            mesh_base_colour, self.colour_groups, mesh_extruders)
+            else:
+                geometry = _create_geometry(*_read_mesh(parent_object.getchildren()[index]),
+                                            mesh_base_colour, self.colour_groups, mesh_extruders)
+            geometries[(mesh_id, index)] = (geometry, mesh_name)
+
+        # Scene is assembled in build order
+        geometry_names = {}
+        for mesh_key, transform in instances:
+            transform = _transform_to_matrix(transform)
+            if mesh_key in geometry_names:
+                # Add another node for the existing geometry
+                geometry_name = geometry_names[mesh_key]
+                if _is_identity_matrix(transform):
+                    transform = np.eye(4)
+                self.model.graph.update(
+                    frame_to=unique_name(geometry_name, self.model.graph.transforms.node_data.keys()),
+                    frame_from=self.model.graph.base_frame,
+                    matrix=transform,
+                    geometry=geometry_name,
+                    geometry_flags={"visible": True}
+                )
+                continue
+            geometry, mesh_name = geometries[mesh_key]
+            geometry = _get_result(geometry)
             if _is_identity_matrix(transform):
-                self.model.add_geometry(geometry, geom_name=mesh_name)
+                node_name = self.model.add_geometry(geometry, geom_name=mesh_name)
             else:
-                self.model.add_geometry(geometry, transform=transform, geom_name=mesh_name)
+                node_name = self.model.add_geometry(geometry, transform=transform, geom_name=mesh_name)
+            geometry_names[mesh_key] = self.model.graph[node_name][1]
 
         self.model.units = self.unit
         return self.model, self.metadata
 
+    def _read_slicer_colours(self, file_3mf: ZipFile) -> list[str]:
+        """Reads the filament/extruder colours from the config of the slicer"""
+        if self.config_name not in file_3mf.namelist():
+            return []
+        with file_3mf.open(self.config_name) as config_file:
+            config_data = config_file.read().decode("utf-8", errors="replace")
+        if self.vendor == "BambuStudio":
+            # Bambu Studio config is json
+            return json.loads(config_data).get("filament_colour", [])
+        # PrusaSlicer config has lines like "; key = value"
+        config = dict(re.findall(r"^; ([\w-]+) = (.*?)\r?$", config_data, re.MULTILINE))
+        extruder_colours = config.get("extruder_colour", "").split(";")
+        filament_colours = config.get("filament_colour", "").split(";")
+        colours = []
+        for index, colour in enumerate(extruder_colours):
+            # Extruders without colour use the colour of their filament
+            if len(colour.strip('" ')) == 0 and index < len(filament_colours):
+                colour = filament_colours[index]
+            colours.append(colour)
+        if len(colours) == 1 and len(colours[0].strip('" ')) == 0:
+            return []
+        return colours
+
+    def _read_object_extruders(self) -> dict:
+        """Reads the extruders of the objects and their volumes (PrusaSlicer) from the slicer model config"""
+        object_extruders = {}
+        for config_object in self.model_config.iterfind("object"):
+            object_extruder = 0
+            volumes = []
+            for element in config_object:
+                if element.tag == "metadata" and element.get("key") == "extruder":
+                    object_extruder = int(element.get("value", 0))
+                elif element.tag == "volume" and element.get("firstid") is not None:
+                    volume_extruder = 0
+                    for metadata in element.iterfind("metadata"):
+                        if metadata.get("key") == "extruder":
+                            volume_extruder = int(metadata.get("value", 0))
+                    volumes.append((int(element.get("firstid")), int(element.get("lastid")), volume_extruder))
+            object_extruders[config_object.get("id")] = (object_extruder, volumes)
+        return object_extruders
+
+    def _parse_streaming(self, model_file):
+        """
+        Parses the model file with iterparse.
+        Vertices and triangles are converted to arrays as soon as they are complete,
+        afterward their elements are cleared. The returned tree only keeps the small elements.
+        """
+        context = etree.iterparse(model_file, events=("end",), tag=("{*}vertices", "{*}triangles"))
+        for _, element in context:
+            mesh = element.getparent()
+            parent_object = mesh.getparent()
+            if parent_object is None or _get_tag_type(parent_object) != "object":
+                continue
+            if parent_object.attrib["type"] == "model":
+                key = (parent_object.attrib["id"], parent_object.index(mesh))
+                mesh_parts = self.mesh_data.setdefault(key, {})
+                data_tag = _get_tag_type(element)
+                if self.pool is not None:
+                    # Reading is done by the workers while parsing continues
+                    mesh_parts[data_tag] = self.pool.submit(_read_mesh_part_xml, etree.tostring(element))
+                elif data_tag == "vertices":
+                    mesh_parts[data_tag] = _read_vertices(element)
+                else:
+                    mesh_parts[data_tag] = _read_triangles(element)
+            element.clear()
+        return context.root
+
     def collect_object_meshes(self, object_id: str, transform: str, depth: int):
         if object_id not in self.sub_models:
             # Not a model
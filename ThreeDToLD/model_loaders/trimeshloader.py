@@ -1,9 +1,9 @@
 from trimesh.scene.scene import Scene
 from trimesh import load_scene
-from ThreeDToLD.model_loaders.modelloader import Modelloader
+from ThreeDToLD.model_loaders.modelloader import Modelloader, as_file_object
 
 
 class Trimeshloader(Modelloader):
 
-    def load_model(self, file) -> tuple[Scene, dict]:
-        return load_scene(file), {}
+    def load_model(self, file, file_type: str = None) -> tuple[Scene, dict]:
+        return load_scene(as_file_object(file), file_type=file_type), {}
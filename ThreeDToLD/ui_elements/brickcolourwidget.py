@@ -5,11 +5,11 @@ from ThreeDToLD.brick_data.brickcolour import (
     get_contrast_colour,
     is_brickcolour,
     get_all_brickcolours,
-    search_brickcolour_by_rgb_colour,
     search_by_color_name
 )
 
 from ThreeDToLD.brick_data.colour_categories import colour_categories
+from ThreeDToLD.brick_data.colour_matching import ColourMetric, get_colour_matcher
 
 from colorpicker import ColorPicker
 
@@ -144,7 +144,10 @@ class BrickcolourDialog(QDialog):
         search_inputs.addWidget(clear_button)
 
         self.search_category_input = QComboBox()
-        self.search_category_input.addItems(["Name", "Colour Values"])
+        # Colour values are compared with the metrics in this order, RGB distance first
+        self.search_metrics = list(ColourMetric)
+        self.search_category_input.addItems(["Name", "Colour Values"] +
+                                            [f"Colour Values ({metric.value})" for metric in self.search_metrics[1:]])
         self.search_category_input.currentIndexChanged.connect(self.update_search_bar)
         search_inputs.addWidget(self.search_category_input)
 
@@ -230,10 +233,12 @@ class BrickcolourDialog(QDialog):
         elif search_type == 0:
             search_results = search_by_color_name(text, self.all_colours)
             self.colourslistmodel.updateData(search_results)
-        elif search_type == 1:
+        elif search_type >= 1:
             if re.search('^#[a-f,A-F,0-9]{6}$', text):
-                search_brickcolour_by_rgb_colour(text, self.all_colours)
-                self.colourslistmodel.updateData()
+                metric = self.search_metrics[search_type - 1]
+                # The matcher of all colours has the palette in the order of self.all_colours
+                search_results = get_colour_matcher(metric=metric).get_ranked_brickcolours(text)
+                self.colourslistmodel.updateData(search_results)
 
     def update_search_bar(self, value):
         self.reset_colours()
@@ -320,7 +325,7 @@ class BrickcolourListmodel(QAbstractTableModel):
 class ColourCategoriesDialog(QDialog):
     def __init__(self, parent=None,
                  title: str = "Colour Categories", message: str = "Select Colour Categories",
-                 buttons=None):
+                 buttons=None, show_metric_selection=False):
         super().__init__(parent)
 
         main_layout = QVBoxLayout()
@@ -340,6 +345,11 @@ class ColourCategoriesDialog(QDialog):
         select_all_button = QPushButton("Select All")
         select_all_button.clicked.connect(self.check_all_items)
 
+        self.metric_input = None
+        if show_metric_selection:
+            self.metric_input = QComboBox()
+            self.metric_input.addItems([metric.value for metric in ColourMetric])
+
         if buttons is None:
             buttons = QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
         button_box = QDialogButtonBox(buttons)
@@ -349,6 +359,9 @@ class ColourCategoriesDialog(QDialog):
         main_layout.addWidget(message_label)
         main_layout.addWidget(self.list_widget)
         main_layout.addWidget(select_all_button)
+        if self.metric_input is not None:
+            main_layout.addWidget(QLabel("Colour Distance:"))
+            main_layout.addWidget(self.metric_input)
         main_layout.addWidget(button_box)
         self.setLayout(main_layout)
 
@@ -359,6 +372,11 @@ class ColourCategoriesDialog(QDialog):
                 selected_items.append(item.text())
         return selected_items
 
+    def get_selected_metric(self) -> ColourMetric:
+        if self.metric_input is None:
+            return ColourMetric.RGB
+        return ColourMetric(self.metric_input.currentText())
+
     def check_all_items(self):
         for item in self.items:
             item.setCheckState(Qt.CheckState.Checked)
@@ -267,7 +267,8 @@ class SubpartTab(QWidget):
     def map_colours_to_LDraw(self):
         categories_dialog = ColourCategoriesDialog(
             message="Select Colour Categories Direct/HTML will be matched with.\n"
-                    "(Only Reversible by reloading and may take a while)"
+                    "(Only Reversible by reloading and may take a while)",
+            show_metric_selection=True
         )
 
         self.main_window.show_loading_screen("Mapping Colours\nCould take a bit of time")
@@ -278,7 +279,7 @@ class SubpartTab(QWidget):
                 QMessageBox.warning(self, "Nothing Selected", "No Categories selected\nMapping Aborted")
                 return
             self.main_window.disable_settings(True)
-            self.subpart.map_to_ldraw_colours(colour_categories)
+            self.subpart.map_to_ldraw_colours(colour_categories, metric=categories_dialog.get_selected_metric())
             self.refresh_content()
             self.main_window.disable_settings(False)
             self.colour_changed.emit()